@@ -0,0 +1,246 @@
+"""插件压测：用伪造的 EventContext 模拟 N 个并发用户驱动 Siliconflow2cow.on_handle_context
+
+需要在 chatgpt-on-wechat 根目录下运行，并先启动 mock_server.py：
+    python plugins/siliconflow2cow/bench/mock_server.py --port 8765
+    python plugins/siliconflow2cow/bench/load_test.py --users 20 --requests 5 --api-base http://127.0.0.1:8765/v1
+
+输出吞吐量、端到端延迟 p50/p95/p99、进程峰值 RSS 和峰值线程数；--json 可保存结果作为基线对比。
+"""
+import argparse
+import gc
+import importlib
+import json
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlparse
+
+PLUGIN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_PROMPTS = [
+    "一只在雨中撑伞的橘猫",
+    "赛博朋克风格的城市夜景",
+    "雪山下的湖泊，清晨薄雾",
+    "a cozy reading nook with warm light",
+    "水墨画风格的仙鹤",
+    "未来感的太空站内部",
+]
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(q * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+# 模拟服务只在本机运行，其他地址会消耗真实的 API 额度
+LOCAL_HOSTS = {"127.0.0.1", "localhost", "::1"}
+
+
+def load_plugin_class(overrides: dict):
+    """导入插件并让它读取压测配置；调用前需要把 chatgpt-on-wechat 根目录加入 sys.path"""
+    import plugins
+
+    package = os.path.basename(PLUGIN_DIR)
+    plugins.instance.current_plugin_path = PLUGIN_DIR
+    importlib.import_module(f"plugins.{package}")
+    plugin_cls = plugins.instance.plugins["SILICONFLOW2COW"]
+
+    with open(os.path.join(PLUGIN_DIR, "config.json"), encoding="utf-8") as f:
+        bench_conf = json.load(f)
+    bench_conf.update(overrides)
+    # 压测时使用独立的配置，不读写真实的插件配置
+    plugin_cls.load_config = lambda self: dict(bench_conf)
+    plugin_cls.save_config = lambda self, config: None
+    return plugin_cls
+
+
+def verify_overrides(plugin, overrides: dict):
+    """确认插件实际使用的是压测配置，否则直接退出，避免请求真实接口或写入真实的数据目录"""
+    for key in ("data_dir", "image_output_dir"):
+        if key in overrides and getattr(plugin, key) != overrides[key]:
+            sys.exit(f"插件没有使用压测配置：{key}={getattr(plugin, key)}，预期 {overrides[key]}")
+    api_base = overrides.get("api_base")
+    if api_base:
+        urls = [plugin.chat_api_url, plugin.model_registry.text_request(plugin.default_drawing_model)[0]]
+        for url in urls:
+            if not url.startswith(api_base.rstrip("/")):
+                sys.exit(f"插件没有使用模拟服务：{url} 不在 {api_base} 下")
+
+
+class BenchChannel:
+    """记录异步模式下通过 channel 推送的结果"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.events = {}
+        self.results = {}
+
+    def expect(self, request_id):
+        event = threading.Event()
+        with self.lock:
+            self.events[request_id] = event
+        return event
+
+    def send(self, reply, context):
+        from bridge.reply import ReplyType
+
+        if reply.type == ReplyType.TEXT:
+            # 提示类文字消息（如实际使用的模型）不计为结果
+            return
+        request_id = context["bench_id"]
+        with self.lock:
+            # 多张图片逐张发送时，以第一条结果为准
+            self.results.setdefault(request_id, (time.perf_counter(), reply))
+            event = self.events.get(request_id)
+        if event:
+            event.set()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Siliconflow2cow 插件压测")
+    parser.add_argument("--users", type=int, default=10, help="并发用户数")
+    parser.add_argument("--requests", type=int, default=5, help="每个用户发送的绘图请求数")
+    parser.add_argument("--model", default="schnell")
+    parser.add_argument("--distinct-prompts", type=int, default=len(DEFAULT_PROMPTS), help="使用的不同提示词数量，越小重复越多")
+    parser.add_argument("--api-base", default="http://127.0.0.1:8765/v1")
+    parser.add_argument("--set", action="append", default=[], metavar="KEY=JSON", help="覆盖插件配置，例如 --set async_mode=true")
+    parser.add_argument("--timeout", type=float, default=300, help="单个请求的最长等待时间（秒）")
+    parser.add_argument("--json", help="把结果写入 JSON 文件")
+    parser.add_argument("--reload-cycles", type=int, default=0, help="压测结束后反复创建/关闭插件实例，检查线程和内存是否泄漏")
+    parser.add_argument("--allow-remote-api", action="store_true", help="允许 --api-base 指向本机以外的地址（会消耗真实额度）")
+    args = parser.parse_args()
+
+    if urlparse(args.api_base).hostname not in LOCAL_HOSTS and not args.allow_remote_api:
+        sys.exit(f"--api-base {args.api_base} 不是本机的模拟服务，如确实需要请加上 --allow-remote-api")
+    sys.path.insert(0, os.getcwd())
+
+    work_dir = tempfile.mkdtemp(prefix="sf2cow-bench-")
+    overrides = {
+        "api_base": args.api_base,
+        "CHAT_API_URL": f"{args.api_base.rstrip('/')}/chat/completions",
+        "image_output_dir": os.path.join(work_dir, "images"),
+        "data_dir": os.path.join(work_dir, "data"),
+        # 忽略真实配置中的 quota_limits，压测不受使用次数限制
+        "quota_limits": None,
+        "dev_model_usage_limit": 10 ** 9,
+        # 不随真实 config.json 的修改重新加载模型注册表
+        "model_registry_reload_interval": 10 ** 9,
+    }
+    for item in args.set:
+        key, _, value = item.partition("=")
+        overrides[key] = json.loads(value)
+
+    from bridge.context import Context, ContextType
+    from bridge.reply import Reply, ReplyType
+    plugin_cls = load_plugin_class(overrides)
+    from plugins import Event, EventContext
+
+    plugin = plugin_cls()
+    verify_overrides(plugin, overrides)
+    channel = BenchChannel()
+    prefix = plugin.drawing_prefixes[0]
+
+    latencies, outcomes = [], {}
+    lock = threading.Lock()
+    peak_threads = [threading.active_count()]
+    running = threading.Event()
+    running.set()
+
+    def monitor():
+        while running.is_set():
+            peak_threads[0] = max(peak_threads[0], threading.active_count())
+            time.sleep(0.05)
+
+    def user_loop(user_index):
+        for i in range(args.requests):
+            request_id = f"{user_index}-{i}"
+            # 在 distinct_prompts 个不同提示词中轮换，超出内置提示词数量时追加编号区分
+            k = (user_index * args.requests + i) % max(1, args.distinct_prompts)
+            prompt = DEFAULT_PROMPTS[k % len(DEFAULT_PROMPTS)]
+            if k >= len(DEFAULT_PROMPTS):
+                prompt = f"{prompt} #{k}"
+            context = Context(ContextType.TEXT, f"{prefix}{prompt} --m {args.model}",
+                              kwargs={"receiver": f"bench-user-{user_index}", "bench_id": request_id, "isgroup": False})
+            e_context = EventContext(Event.ON_HANDLE_CONTEXT, {"channel": channel, "context": context, "reply": Reply()})
+            event = channel.expect(request_id)
+            start = time.perf_counter()
+            plugin.on_handle_context(e_context)
+            reply = e_context["reply"]
+            finished = time.perf_counter()
+            if plugin.async_mode and reply.type == ReplyType.TEXT and event.wait(args.timeout):
+                finished, reply = channel.results[request_id]
+            outcome = "ok" if reply.type == ReplyType.IMAGE else "error"
+            with lock:
+                latencies.append(finished - start)
+                outcomes[outcome] = outcomes.get(outcome, 0) + 1
+
+    threading.Thread(target=monitor, daemon=True).start()
+    started = time.perf_counter()
+    workers = [threading.Thread(target=user_loop, args=(u,)) for u in range(args.users)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - started
+    running.clear()
+
+    result = {
+        "users": args.users,
+        "requests": len(latencies),
+        "outcomes": outcomes,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 3) if elapsed else 0,
+        "p50_s": round(percentile(latencies, 0.50), 3),
+        "p95_s": round(percentile(latencies, 0.95), 3),
+        "p99_s": round(percentile(latencies, 0.99), 3),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "peak_threads": peak_threads[0],
+        "overrides": {k: v for k, v in overrides.items() if k not in ("image_output_dir", "data_dir")},
+    }
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+    plugin.shutdown()
+
+    if args.reload_cycles:
+        check_reloads(plugin_cls, args.reload_cycles)
+
+
+def check_reloads(plugin_cls, cycles: int):
+    """反复创建、关闭插件实例，检查线程数和内存是否保持平稳"""
+    gc.collect()
+    baseline_threads = threading.active_count()
+    baseline_rss = current_rss_mb()
+    for _ in range(cycles):
+        plugin_cls()  # 新实例会关闭上一个实例遗留的调度线程
+    plugin_cls().shutdown()
+    gc.collect()
+    result = {
+        "reload_cycles": cycles,
+        "threads_before": baseline_threads,
+        "threads_after": threading.active_count(),
+        "rss_before_mb": baseline_rss,
+        "rss_after_mb": current_rss_mb(),
+    }
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+
+def current_rss_mb() -> float:
+    """当前常驻内存（仅 Linux），其他平台返回 0"""
+    try:
+        with open("/proc/self/statm") as f:
+            return round(int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024, 1)
+    except (OSError, ValueError):
+        return 0.0
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+"""本地 SiliconFlow 模拟服务，用于在不消耗额度的情况下压测插件
+
+实现 /v1/chat/completions、各模型的 text-to-image / image-to-image、/v1/images/generations，
+并在 /files/ 下托管生成的图片。延迟服从对数正态分布，可配置错误率、429 比例和图片大小。
+
+用法：
+    python mock_server.py --port 8765 --gen-latency 3 --error-rate 0.01 --throttle-rate 0.05
+然后在插件配置中设置：
+    "api_base": "http://127.0.0.1:8765/v1",
+    "CHAT_API_URL": "http://127.0.0.1:8765/v1/chat/completions"
+"""
+import argparse
+import json
+import math
+import os
+import random
+import struct
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def make_png(width: int, height: int, compress_level: int = 1) -> bytes:
+    """生成随机噪点 PNG，不依赖 Pillow；噪点几乎不可压缩，文件大小约为 width * height * 3"""
+
+    def chunk(tag: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xFFFFFFFF)
+
+    row_size = width * 3
+    raw = b"".join(b"\x00" + os.urandom(row_size) for _ in range(height))
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(raw, compress_level)) + chunk(b"IEND", b"")
+
+
+class MockState:
+    def __init__(self, args):
+        self.args = args
+        self.lock = threading.Lock()
+        self.counts = {}
+        side = max(1, int(math.sqrt(args.image_kb * 1024 / 3)))
+        self.image = make_png(side, side)
+        self.etag = f'"{zlib.crc32(self.image):08x}"'
+
+    def count(self, name: str):
+        with self.lock:
+            self.counts[name] = self.counts.get(name, 0) + 1
+
+    def sleep(self, median: float):
+        if median > 0:
+            time.sleep(random.lognormvariate(math.log(median), self.args.latency_sigma))
+
+
+def make_handler(state: MockState):
+    args = state.args
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, fmt, *log_args):
+            if args.verbose:
+                super().log_message(fmt, *log_args)
+
+        def _send_json(self, status: int, body: dict, headers: dict = None):
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _read_json(self) -> dict:
+            length = int(self.headers.get("Content-Length") or 0)
+            raw = self.rfile.read(length) if length else b"{}"
+            try:
+                return json.loads(raw)
+            except ValueError:
+                return {}
+
+        def _inject_failure(self) -> bool:
+            roll = random.random()
+            if roll < args.throttle_rate:
+                state.count("throttled")
+                self._send_json(429, {"error": {"message": "rate limited"}}, {"Retry-After": str(args.retry_after)})
+                return True
+            if roll < args.throttle_rate + args.error_rate:
+                state.count("errors")
+                self._send_json(503, {"error": {"message": "mock upstream error"}})
+                return True
+            return False
+
+        def do_POST(self):
+            body = self._read_json()
+            path = self.path.split("?")[0]
+            if path.endswith("/chat/completions"):
+                state.count("chat")
+                state.sleep(args.chat_latency)
+                if self._inject_failure():
+                    return
+                messages = body.get("messages", [])
+                user_text = messages[-1]["content"] if messages else ""
+                content = f"A detailed, high quality illustration of {user_text}, cinematic lighting"
+                self._send_json(200, {"choices": [{"message": {"role": "assistant", "content": content}}]})
+                return
+            if path.endswith(("/text-to-image", "/image-to-image", "/images/generations", "/image/generations")):
+                state.count("generate")
+                state.sleep(args.gen_latency)
+                if self._inject_failure():
+                    return
+                host = self.headers.get("Host", f"127.0.0.1:{args.port}")
+                batch = max(1, int(body.get("batch_size", 1)))
+                images = [{"url": f"http://{host}/files/{random.getrandbits(64):016x}.png"} for _ in range(batch)]
+                self._send_json(200, {"images": images, "timings": {"inference": args.gen_latency}})
+                return
+            self._send_json(404, {"error": {"message": f"unknown route {path}"}})
+
+        def do_GET(self):
+            path = self.path.split("?")[0]
+            if path == "/stats":
+                with state.lock:
+                    self._send_json(200, dict(state.counts))
+                return
+            if not path.startswith("/files/"):
+                self._send_json(404, {"error": {"message": "not found"}})
+                return
+            state.count("download")
+            if self.headers.get("If-None-Match") == state.etag:
+                self.send_response(304)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            state.sleep(args.download_latency)
+            self.send_response(200)
+            self.send_header("Content-Type", "image/png")
+            self.send_header("Content-Length", str(len(state.image)))
+            self.send_header("ETag", state.etag)
+            self.end_headers()
+            self.wfile.write(state.image)
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SiliconFlow 模拟服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--chat-latency", type=float, default=0.8, help="提示词增强延迟中位数（秒）")
+    parser.add_argument("--gen-latency", type=float, default=3.0, help="生图延迟中位数（秒）")
+    parser.add_argument("--download-latency", type=float, default=0.2, help="图片下载延迟中位数（秒）")
+    parser.add_argument("--latency-sigma", type=float, default=0.4, help="对数正态分布的 sigma，越大长尾越明显")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回 503 的比例")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="返回 429 的比例")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="429 响应的 Retry-After（秒）")
+    parser.add_argument("--image-kb", type=int, default=2048, help="托管图片的大小（KB）")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(MockState(args)))
+    server.daemon_threads = True
+    print(f"SiliconFlow 模拟服务已启动: http://{args.host}:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
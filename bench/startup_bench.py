@@ -0,0 +1,146 @@
+"""插件冷启动基准：在全新的子进程中加载 Siliconflow2cow，统计导入耗时、初始化耗时和常驻内存
+
+需要在 chatgpt-on-wechat 根目录下运行：
+    python plugins/siliconflow2cow/bench/startup_bench.py --runs 5
+    python plugins/siliconflow2cow/bench/startup_bench.py --set lazy_init=false
+
+每次运行都用 python -X importtime 启动子进程，先导入宿主程序的模块，再导入插件并创建实例，
+输出各项耗时的中位数、插件带来的内存增量以及导入最慢的模块；--json 可保存结果，按版本对比。
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+IMPORT_MARKER = "--- sf2cow plugin import ---"
+IMPORT_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|(\s+)(\S+)")
+
+
+def run_child(overrides: dict):
+    """子进程：依次导入宿主模块、导入插件、创建实例、首次使用各子系统，输出 JSON"""
+    sys.path.insert(0, BENCH_DIR)
+    from load_test import current_rss_mb, load_plugin_class, verify_overrides
+
+    sys.path.insert(0, os.getcwd())
+    import plugins  # noqa: F401  宿主程序本身的导入不计入插件
+    import bridge.context  # noqa: F401
+    import bridge.reply  # noqa: F401
+    import common.log  # noqa: F401
+
+    rss_host = current_rss_mb()
+    sys.stderr.write(IMPORT_MARKER + "\n")
+    sys.stderr.flush()
+    start = time.perf_counter()
+    plugin_cls = load_plugin_class(overrides)
+    imported = time.perf_counter()
+    plugin = plugin_cls()
+    initialized = time.perf_counter()
+    rss_init = current_rss_mb()
+    verify_overrides(plugin, overrides)
+    # 延迟初始化时创建实例后周期任务还没有启动
+    lazy = not plugin.started
+    if lazy != bool(overrides.get("lazy_init", True)):
+        sys.exit(f"lazy_init={overrides.get('lazy_init', True)} 没有生效")
+
+    # 延迟创建的子系统在收到第一条消息时才会用到，单独计时
+    from importlib import import_module
+    module = import_module(plugin_cls.__module__)
+    for name in module.LAZY_SUBSYSTEMS:
+        getattr(plugin, name)
+    plugin.ensure_started()
+    first_use = time.perf_counter()
+    rss_first_use = current_rss_mb()
+    plugin.shutdown(timeout=1)
+
+    print(json.dumps({
+        "version": getattr(plugin_cls, "version", ""),
+        "lazy_init": lazy,
+        "import_s": imported - start,
+        "init_s": initialized - imported,
+        "first_use_s": first_use - initialized,
+        "rss_host_mb": rss_host,
+        "rss_init_mb": rss_init,
+        "rss_first_use_mb": rss_first_use,
+    }))
+
+
+def parse_importtime(stderr: str) -> list:
+    """解析插件导入阶段的 -X importtime 输出，返回 (模块, 自身耗时 us, 累计耗时 us) 列表"""
+    _, _, tail = stderr.partition(IMPORT_MARKER)
+    modules = []
+    for line in tail.splitlines():
+        match = IMPORT_LINE.match(line)
+        if match:
+            modules.append((match.group(4), int(match.group(1)), int(match.group(2))))
+    return modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Siliconflow2cow 插件冷启动基准")
+    parser.add_argument("--runs", type=int, default=5, help="子进程运行次数，结果取中位数")
+    parser.add_argument("--top", type=int, default=10, help="列出自身导入耗时最长的模块数")
+    parser.add_argument("--set", action="append", default=[], metavar="KEY=JSON", help="覆盖插件配置，例如 --set lazy_init=false")
+    parser.add_argument("--json", help="把结果写入 JSON 文件")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--overrides", default="{}", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(json.loads(args.overrides))
+        return
+
+    work_dir = tempfile.mkdtemp(prefix="sf2cow-startup-")
+    overrides = {
+        "image_output_dir": os.path.join(work_dir, "images"),
+        "data_dir": os.path.join(work_dir, "data"),
+    }
+    for item in args.set:
+        key, _, value = item.partition("=")
+        overrides[key] = json.loads(value)
+
+    runs, import_times = [], {}
+    for i in range(args.runs):
+        # 每次使用新的数据目录，避免前一次运行创建的数据库影响初始化耗时
+        run_overrides = dict(overrides, image_output_dir=f"{overrides['image_output_dir']}-{i}", data_dir=f"{overrides['data_dir']}-{i}")
+        proc = subprocess.run(
+            [sys.executable, "-X", "importtime", os.path.abspath(__file__), "--child", "--overrides", json.dumps(run_overrides)],
+            capture_output=True, text=True,
+        )
+        if proc.returncode != 0:
+            sys.stderr.write(proc.stderr)
+            sys.exit(proc.returncode)
+        runs.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+        for name, self_us, _ in parse_importtime(proc.stderr):
+            import_times.setdefault(name, []).append(self_us)
+
+    def median(key):
+        return round(statistics.median(run[key] for run in runs), 4)
+
+    slowest = sorted(import_times.items(), key=lambda item: statistics.median(item[1]), reverse=True)[:args.top]
+    result = {
+        "version": runs[0]["version"],
+        "lazy_init": runs[0]["lazy_init"],
+        "runs": args.runs,
+        "import_s": median("import_s"),
+        "init_s": median("init_s"),
+        "cold_start_s": round(median("import_s") + median("init_s"), 4),
+        "first_use_s": median("first_use_s"),
+        "baseline_rss_mb": round(statistics.median(run["rss_init_mb"] - run["rss_host_mb"] for run in runs), 1),
+        "first_use_rss_mb": round(statistics.median(run["rss_first_use_mb"] - run["rss_host_mb"] for run in runs), 1),
+        "slowest_imports_ms": {name: round(statistics.median(times) / 1000, 2) for name, times in slowest},
+        "overrides": {k: v for k, v in overrides.items() if k not in ("image_output_dir", "data_dir")},
+    }
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+import time
+from typing import Iterable, Iterator, Optional, Tuple
+
+
+# 未按模型配置时各阶段的默认预算（秒）：total 为整个请求的期限，enhance 为提示词增强最多占用的时间，
+# download 为生成阶段需要为下载保留的时间
+DEFAULT_BUDGETS = {"total": 300, "enhance": 20, "download": 30}
+
+
+class DeadlineExceeded(Exception):
+    """请求超出期限，异常信息即回复给用户的文案"""
+
+
+class Deadline:
+    """请求的截止时间，按阶段切分后传给各个阶段；seconds 不大于 0 表示不限时"""
+
+    def __init__(self, seconds: float, expires: float = None):
+        self.seconds = seconds
+        if expires is not None:
+            self.expires = expires
+        else:
+            self.expires = time.monotonic() + seconds if seconds > 0 else float("inf")
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires - time.monotonic())
+
+    def wait_timeout(self) -> Optional[float]:
+        """用作 Event.wait 等待时的超时参数；不限时返回 None（传入无穷大会引发 OverflowError）"""
+        return None if self.expires == float("inf") else self.remaining()
+
+    def expired(self) -> bool:
+        return time.monotonic() >= self.expires
+
+    def check(self, stage: str = ""):
+        if self.expired():
+            where = f"，{stage}阶段未能完成" if stage else ""
+            raise DeadlineExceeded(f"绘图超时（超过 {self.seconds:g} 秒{where}），请稍后重试或换用更快的模型。")
+
+    def slice(self, seconds: float) -> "Deadline":
+        """从现在起最多 seconds 秒、且不晚于本期限的子期限"""
+        if seconds <= 0:
+            return self
+        return Deadline(seconds, min(self.expires, time.monotonic() + seconds))
+
+    def reserve(self, seconds: float) -> "Deadline":
+        """提前 seconds 秒结束的子期限，为后续阶段保留时间"""
+        return Deadline(self.seconds, self.expires - max(0.0, seconds))
+
+    def timeout(self, default: Tuple[float, float], stage: str = "") -> Tuple[float, float]:
+        """把 (连接超时, 读取超时) 限制在剩余时间内，已超时则抛出 DeadlineExceeded"""
+        self.check(stage)
+        remaining = self.remaining()
+        return min(default[0], remaining), min(default[1], remaining)
+
+    def guard(self, chunks: Iterable[bytes], stage: str = "") -> Iterator[bytes]:
+        """逐块检查期限，用于流式下载（读取超时只限制单次读取，不限制总时长）"""
+        for chunk in chunks:
+            self.check(stage)
+            yield chunk
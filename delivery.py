@@ -0,0 +1,101 @@
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from typing import Callable, Optional
+
+from common.log import logger
+
+
+# 按字节预算压缩时允许的最低质量
+MIN_QUALITY = 40
+
+
+def encode_for_delivery(src_path: str, fmt: str, quality: int, max_bytes: int = 0, max_side: int = 0) -> dict:
+    """在子进程中执行：把原图编码为适合发送的格式，超出字节预算时二分降低质量"""
+    from PIL import Image
+
+    start = time.perf_counter()
+    with Image.open(src_path) as image:
+        if max_side and max(image.size) > max_side:
+            # JPEG 可以直接按缩小后的尺寸解码
+            image.draft("RGB", (max_side, max_side))
+            image.thumbnail((max_side, max_side))
+        if image.mode not in ("RGB", "L") and not (fmt == "WEBP" and image.mode == "RGBA"):
+            image = image.convert("RGB")
+
+        def encode(q: int) -> bytes:
+            buffer = BytesIO()
+            image.save(buffer, format=fmt, quality=q)
+            return buffer.getvalue()
+
+        data = encode(quality)
+        if max_bytes and len(data) > max_bytes:
+            low, high, best = MIN_QUALITY, quality - 1, None
+            while low <= high:
+                q = (low + high) // 2
+                candidate = encode(q)
+                if len(candidate) <= max_bytes:
+                    best, low = candidate, q + 1
+                else:
+                    high = q - 1
+            data = best or encode(MIN_QUALITY)
+    return {"data": data, "seconds": time.perf_counter() - start}
+
+
+class DeliveryEncoder:
+    """发送前的图片压缩阶段，在进程池中编码以免占用消息线程的 GIL；原图仍保留在图片目录中"""
+
+    def __init__(self, fmt: str = "WEBP", quality: int = 85, max_bytes: int = 0, max_side: int = 0,
+                 workers: int = 2, start_method: str = "spawn", on_encoded: Callable[[int], None] = None):
+        self.fmt = fmt.upper().replace("JPG", "JPEG")
+        self.quality = quality
+        self.max_bytes = max_bytes
+        self.max_side = max_side
+        self.workers = workers
+        self.start_method = start_method
+        self._executor = None
+        # 每张压缩后变小的图片以节省的字节数调用一次
+        self.on_encoded = on_encoded or (lambda saved: None)
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context(self.start_method)
+                )
+            return self._executor
+
+    def encode(self, src_path: str, timeout: float = 60) -> Optional[BytesIO]:
+        """返回压缩后的图片；压缩失败或没有变小时返回 None，调用方直接发送原图"""
+        original_size = os.path.getsize(src_path)
+        try:
+            future = self._get_executor().submit(
+                encode_for_delivery, src_path, self.fmt, self.quality, self.max_bytes, self.max_side
+            )
+            result = future.result(timeout=timeout)
+        except Exception as e:
+            logger.error(f"[Siliconflow2cow] 图片压缩失败，发送原图，错误：{e}")
+            return None
+
+        data = result["data"]
+        if len(data) >= original_size:
+            return None
+        try:
+            self.on_encoded(original_size - len(data))
+        except Exception as e:
+            logger.error(f"[Siliconflow2cow] 记录图片压缩统计失败，错误：{e}")
+        logger.info(
+            f"[Siliconflow2cow] 图片已压缩为 {self.fmt}: {original_size / 1024:.0f}KB -> {len(data) / 1024:.0f}KB，"
+            f"耗时 {result['seconds']:.2f}s"
+        )
+        return BytesIO(data)
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
@@ -0,0 +1,104 @@
+import json
+import threading
+from typing import Callable, Dict, List, Optional
+
+from common.log import logger
+
+
+BATCH_INSTRUCTION = (
+    "\n\n你将收到一个 JSON 字符串数组，其中每个元素是一条独立的绘图提示词。"
+    "请按上面的要求分别处理每一条，只输出一个与输入等长、顺序一致的 JSON 字符串数组，不要输出任何其他内容。"
+)
+
+
+def build_batch_messages(system_prompt: str, prompts: List[str]) -> List[dict]:
+    return [
+        {"role": "system", "content": system_prompt + BATCH_INSTRUCTION},
+        {"role": "user", "content": json.dumps(prompts, ensure_ascii=False)},
+    ]
+
+
+def parse_batch_output(text: str, expected: int) -> Optional[List[str]]:
+    """从模型输出中解析 JSON 字符串数组，格式不符或数量不一致时返回 None"""
+    start, end = text.find("["), text.rfind("]")
+    if start < 0 or end <= start:
+        return None
+    try:
+        items = json.loads(text[start:end + 1])
+    except ValueError:
+        return None
+    if not isinstance(items, list) or len(items) != expected:
+        return None
+    if not all(isinstance(item, str) and item.strip() for item in items):
+        return None
+    return [item.strip() for item in items]
+
+
+class _Batch:
+    def __init__(self):
+        self.prompts: List[str] = []
+        self.results: Optional[List[str]] = None
+        self.full = threading.Event()
+        self.done = threading.Event()
+
+
+class EnhanceBatcher:
+    """把时间窗口内到达的提示词合并为一次增强请求，结果按顺序分发给各个调用方
+
+    第一个到达的调用方负责等待窗口结束（或凑满 max_batch 条）后发出请求；
+    批量结果解析失败时，每个调用方各自退回单条增强。
+    """
+
+    def __init__(self, enhance_one: Callable[..., str], enhance_many: Callable[..., Optional[List[str]]],
+                 window: float = 0.1, max_batch: int = 8, on_event: Callable[[str, dict], None] = None):
+        self.enhance_one = enhance_one
+        self.enhance_many = enhance_many
+        self.window = window
+        self.max_batch = max_batch
+        self.on_event = on_event or (lambda name, labels: None)
+        self._lock = threading.Lock()
+        # 按系统提示词分组，不同增强策略的提示词不能合并
+        self._open: Dict[str, _Batch] = {}
+
+    def enhance(self, system_prompt: str, prompt: str, deadline=None) -> str:
+        """deadline（Deadline）为本次增强的期限，等待批量结果超时时抛出 DeadlineExceeded"""
+        with self._lock:
+            batch = self._open.get(system_prompt)
+            leader = batch is None
+            if leader:
+                batch = self._open[system_prompt] = _Batch()
+            index = len(batch.prompts)
+            batch.prompts.append(prompt)
+            if len(batch.prompts) >= self.max_batch:
+                del self._open[system_prompt]
+                batch.full.set()
+
+        if leader:
+            batch.full.wait(self.window)
+            with self._lock:
+                if self._open.get(system_prompt) is batch:
+                    del self._open[system_prompt]
+            self._execute(system_prompt, batch, deadline)
+        elif not batch.done.wait(deadline.wait_timeout() if deadline else None):
+            deadline.check("提示词增强")
+
+        if batch.results is None:
+            return self.enhance_one(system_prompt, prompt, deadline)
+        return batch.results[index]
+
+    def _execute(self, system_prompt: str, batch: _Batch, deadline=None):
+        try:
+            if len(batch.prompts) == 1:
+                # 窗口内只有一条，由调用方直接走单条增强
+                return
+            self.on_event("enhance_batches", {"size": str(len(batch.prompts))})
+            try:
+                batch.results = self.enhance_many(system_prompt, batch.prompts, deadline)
+            except Exception as e:
+                logger.warning(f"[Siliconflow2cow] 批量提示词增强失败，改为逐条增强，错误：{e}")
+            if batch.results is None:
+                self.on_event("enhance_batch_fallbacks", {})
+            else:
+                logger.debug("[Siliconflow2cow] 合并增强了 %s 条提示词", len(batch.prompts))
+        finally:
+            batch.done.set()
@@ -0,0 +1,202 @@
+import itertools
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Callable, Dict, List, Optional, Tuple
+
+from common.log import logger
+
+
+# 最多保留等待统计的租户数
+MAX_TENANT_STATS = 500
+
+
+class QueueLimitExceeded(Exception):
+    """同一用户排队中的任务过多，异常信息即回复给用户的文案"""
+
+
+class Ticket:
+    """一次绘图请求在公平队列中的排队凭证"""
+
+    def __init__(self, group: str, user: str, cost: float, seq: int):
+        self.group = group
+        self.user = user
+        self.cost = cost
+        self.seq = seq
+        self.start_tag = 0.0
+        self.enqueued = time.monotonic()
+        self.granted_at: Optional[float] = None
+        self.granted = threading.Event()
+        self.on_grant: Optional[Callable[["Ticket"], None]] = None
+        self.done = False
+
+
+class _Flow:
+    def __init__(self):
+        self.tickets: deque = deque()
+        self.in_flight = 0
+        self.finish_tag = 0.0
+
+
+class FairScheduler:
+    """按用户和群组加权公平地分配绘图并发（开始时间公平排队，SFQ）
+
+    每个用户是一个流，任务的虚拟开始时间为 max(当前虚拟时间, 该流上一个任务的结束时间)，
+    结束时间 = 开始时间 + 成本 / 权重；空闲时按开始时间最小的顺序放行。
+    用户权重会除以所在群组中活跃的用户数，因此每个群组整体与一个私聊用户分得相同的份额，
+    群组内的用户再平分；管理员权重更高，贵的模型和多张图片成本更高。
+    每个用户同时执行的任务数不超过 max_in_flight。
+    """
+
+    def __init__(self, capacity: int = 8, max_in_flight: int = 2, max_queued: int = 5,
+                 on_wait: Callable[[Ticket, float], None] = None):
+        self.capacity = max(1, capacity)
+        self.max_in_flight = max_in_flight
+        self.max_queued = max_queued
+        self.on_wait = on_wait or (lambda ticket, seconds: None)
+        self._cond = threading.Condition()
+        self._seq = itertools.count()
+        self._flows: Dict[Tuple[str, str], _Flow] = {}
+        self._virtual_time = 0.0
+        self._in_flight = 0
+        self._in_flight_cost = 0.0
+        # 每单位成本的平均执行时间（指数加权），用于估算等待时间
+        self._seconds_per_cost = 0.0
+        self._tenant_waits: "OrderedDict[str, list]" = OrderedDict()
+        self._callback_state = threading.local()
+
+    def _active_users(self, group: str) -> int:
+        return sum(1 for (g, _), flow in self._flows.items() if g == group and (flow.tickets or flow.in_flight))
+
+    def enqueue(self, group: str, user: str, weight: float = 1, cost: float = 1) -> Ticket:
+        """登记一个任务，有空闲名额时立即放行；该用户排队任务过多时抛出 QueueLimitExceeded"""
+        with self._cond:
+            key = (group, user)
+            flow = self._flows.get(key)
+            if flow is None:
+                flow = self._flows[key] = _Flow()
+            if self.max_queued and len(flow.tickets) >= self.max_queued:
+                raise QueueLimitExceeded(f"您已有 {len(flow.tickets)} 个绘图任务在排队，请等待完成后再试。")
+            share = weight / max(1, self._active_users(group) + (0 if flow.tickets or flow.in_flight else 1))
+            ticket = Ticket(group, user, cost, next(self._seq))
+            ticket.start_tag = max(self._virtual_time, flow.finish_tag)
+            flow.finish_tag = ticket.start_tag + cost / share
+            flow.tickets.append(ticket)
+            granted = self._dispatch()
+        self._run_grant_callbacks(granted)
+        return ticket
+
+    def when_granted(self, ticket: Ticket, callback: Callable[[Ticket], None]):
+        """放行时在放行的线程中调用 callback(ticket)，已放行时立即调用；用于放行后才占用工作线程"""
+        with self._cond:
+            if not ticket.granted.is_set():
+                ticket.on_grant = callback
+                return
+        self._run_grant_callbacks([(ticket, callback)])
+
+    def _run_grant_callbacks(self, granted: List[Tuple[Ticket, Callable[[Ticket], None]]]):
+        # 在锁外调用；回调中调用 done 放行的后续任务排在本线程的待执行列表中，不会层层递归
+        state = self._callback_state
+        if getattr(state, "pending", None) is not None:
+            state.pending.extend(granted)
+            return
+        state.pending = deque(granted)
+        try:
+            while state.pending:
+                ticket, callback = state.pending.popleft()
+                try:
+                    callback(ticket)
+                except Exception as e:
+                    logger.error(f"[Siliconflow2cow] 启动已放行的绘图任务失败，错误：{e}")
+                    self.done(ticket)
+        finally:
+            state.pending = None
+
+    def _dispatch(self) -> List[Tuple[Ticket, Callable[[Ticket], None]]]:
+        """按开始时间放行任务，返回需要在锁外调用的 (凭证, 放行回调) 列表"""
+        granted = []
+        while self._in_flight < self.capacity:
+            best_key, best = None, None
+            for key, flow in self._flows.items():
+                if not flow.tickets or (self.max_in_flight and flow.in_flight >= self.max_in_flight):
+                    continue
+                head = flow.tickets[0]
+                if best is None or (head.start_tag, head.seq) < (best.start_tag, best.seq):
+                    best_key, best = key, head
+            if best is None:
+                break
+            flow = self._flows[best_key]
+            flow.tickets.popleft()
+            flow.in_flight += 1
+            self._in_flight += 1
+            self._in_flight_cost += best.cost
+            self._virtual_time = max(self._virtual_time, best.start_tag)
+            best.granted_at = time.monotonic()
+            best.granted.set()
+            self._record_wait(best)
+            if best.on_grant is not None:
+                granted.append((best, best.on_grant))
+                best.on_grant = None
+        return granted
+
+    def _record_wait(self, ticket: Ticket):
+        seconds = ticket.granted_at - ticket.enqueued
+        tenant = ticket.user if ticket.group == ticket.user else f"{ticket.group}/{ticket.user}"
+        stats = self._tenant_waits.pop(tenant, None) or [0, 0.0, 0.0]
+        stats[0] += 1
+        stats[1] += seconds
+        stats[2] = max(stats[2], seconds)
+        self._tenant_waits[tenant] = stats
+        if len(self._tenant_waits) > MAX_TENANT_STATS:
+            self._tenant_waits.popitem(last=False)
+        try:
+            self.on_wait(ticket, seconds)
+        except Exception as e:
+            logger.error(f"[Siliconflow2cow] 记录排队等待时间失败，错误：{e}")
+
+    def position(self, ticket: Ticket) -> Tuple[int, float]:
+        """返回 (前面排队的任务数, 预计等待秒数)；已放行时为 (0, 0)，等待时间未知时为 0"""
+        with self._cond:
+            if ticket.granted.is_set() or ticket.done:
+                return 0, 0.0
+            queued = [t for flow in self._flows.values() for t in flow.tickets]
+            ahead = [t for t in queued if (t.start_tag, t.seq) < (ticket.start_tag, ticket.seq)]
+            cost_ahead = sum(t.cost for t in ahead)
+            # 执行中的任务平均已完成一半
+            eta = self._seconds_per_cost * (cost_ahead + self._in_flight_cost / 2) / self.capacity
+            return len(ahead), eta
+
+    def wait(self, ticket: Ticket, timeout: float = None) -> bool:
+        """等待放行，超时返回 False（凭证仍需调用 done 释放）"""
+        return ticket.granted.wait(timeout)
+
+    def done(self, ticket: Ticket):
+        """任务结束或放弃排队时调用，释放名额并放行后续任务"""
+        with self._cond:
+            if ticket.done:
+                return
+            ticket.done = True
+            ticket.on_grant = None
+            flow = self._flows.get((ticket.group, ticket.user))
+            if ticket.granted.is_set():
+                self._in_flight -= 1
+                self._in_flight_cost -= ticket.cost
+                if flow is not None:
+                    flow.in_flight -= 1
+                per_cost = (time.monotonic() - ticket.granted_at) / max(ticket.cost, 1e-6)
+                self._seconds_per_cost = per_cost if not self._seconds_per_cost else 0.8 * self._seconds_per_cost + 0.2 * per_cost
+            elif flow is not None and ticket in flow.tickets:
+                flow.tickets.remove(ticket)
+            if flow is not None and not flow.tickets and not flow.in_flight:
+                del self._flows[(ticket.group, ticket.user)]
+            granted = self._dispatch()
+        self._run_grant_callbacks(granted)
+
+    def format_stats(self, top: int = 10) -> str:
+        with self._cond:
+            queued = sum(len(flow.tickets) for flow in self._flows.values())
+            lines = [f"执行中 {self._in_flight}/{self.capacity}，排队 {queued}，活跃用户 {len(self._flows)}"]
+            waits = sorted(self._tenant_waits.items(), key=lambda item: item[1][1], reverse=True)[:top]
+        for tenant, (count, total, longest) in waits:
+            lines.append(f"{tenant}: {count}次，平均等待 {total / count:.1f}s，最长 {longest:.1f}s")
+        return "\n".join(lines)
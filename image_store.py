@@ -0,0 +1,130 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from typing import Iterable, Optional
+
+from common.log import logger
+
+from .shared_state import open_shared_db
+
+
+# 写入中的临时文件名前缀
+TEMP_PREFIX = ".tmp-"
+
+# 文件头魔数 -> 扩展名
+MAGIC_NUMBERS = [
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"\xff\xd8\xff", "jpg"),
+    (b"GIF87a", "gif"),
+    (b"GIF89a", "gif"),
+    (b"BM", "bmp"),
+]
+
+
+def sniff_format(head: bytes) -> Optional[str]:
+    """根据文件头判断图片格式，无法识别时返回 None"""
+    if len(head) >= 12 and head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    for magic, ext in MAGIC_NUMBERS:
+        if head.startswith(magic):
+            return ext
+    return None
+
+
+class ImageStore:
+    """按内容摘要命名的图片仓库，并记录「生成请求 -> 图片」的索引以便复用相同结果"""
+
+    def __init__(self, root_dir: str, index_path: str):
+        self.root_dir = root_dir
+        os.makedirs(root_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = open_shared_db(index_path)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS image_index ("
+            "request_key TEXT PRIMARY KEY, filename TEXT NOT NULL, created REAL NOT NULL)"
+        )
+        self.reused = 0
+
+    @staticmethod
+    def request_key(model_key: str, image_size: str, prompt: str, params: dict = None) -> str:
+        """由模型、尺寸、增强后的提示词和其他生成参数计算请求键"""
+        payload = json.dumps([model_key, image_size, prompt, params or {}], ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def put(self, data: bytes, ext: str = "png") -> str:
+        """写入图片内容，文件名取内容摘要；相同内容只保存一份，返回文件路径"""
+        digest = hashlib.sha256(data).hexdigest()
+        file_path = os.path.join(self.root_dir, f"{digest[:32]}.{ext}")
+        if os.path.exists(file_path):
+            # 已存在相同内容，刷新修改时间避免被当作旧图片清理
+            os.utime(file_path)
+            return file_path
+        # 先写临时文件再原子替换，并发写同一内容也不会得到半个文件
+        # 临时文件不带图片扩展名，不会被图片清理和清单重建当作图片
+        fd, tmp_path = tempfile.mkstemp(dir=self.root_dir, prefix=TEMP_PREFIX)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, file_path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return file_path
+
+    def put_stream(self, chunks: Iterable[bytes]) -> str:
+        """边接收边写入临时文件并计算摘要，不在内存中缓存整张图片；格式由文件头判断，无法识别时扩展名为 bin"""
+        hasher = hashlib.sha256()
+        head = b""
+        fd, tmp_path = tempfile.mkstemp(dir=self.root_dir, prefix=TEMP_PREFIX)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in chunks:
+                    if not chunk:
+                        continue
+                    if len(head) < 12:
+                        head += chunk[:12 - len(head)]
+                    hasher.update(chunk)
+                    f.write(chunk)
+            ext = sniff_format(head) or "bin"
+            file_path = os.path.join(self.root_dir, f"{hasher.hexdigest()[:32]}.{ext}")
+            if os.path.exists(file_path):
+                os.remove(tmp_path)
+                os.utime(file_path)
+            else:
+                os.replace(tmp_path, file_path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return file_path
+
+    def link(self, request_key: str, file_path: str):
+        """记录请求键对应的图片"""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO image_index (request_key, filename, created) VALUES (?, ?, ?)",
+                (request_key, os.path.basename(file_path), time.time()),
+            )
+
+    def lookup(self, request_key: str) -> Optional[str]:
+        """查找之前相同请求生成的图片，图片已被清理时返回 None 并删除索引"""
+        with self._lock:
+            row = self._conn.execute("SELECT filename FROM image_index WHERE request_key = ?", (request_key,)).fetchone()
+        if row is None:
+            return None
+        file_path = os.path.join(self.root_dir, row[0])
+        if not os.path.isfile(file_path):
+            with self._lock:
+                self._conn.execute("DELETE FROM image_index WHERE request_key = ?", (request_key,))
+            return None
+        self.reused += 1
+        logger.debug("[Siliconflow2cow] 复用已生成的图片: %s", file_path)
+        return file_path
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,31 @@
+import threading
+
+
+class lazy_property:
+    """首次访问时才调用工厂方法创建属性值，之后直接从实例字典读取
+
+    多个线程同时首次访问时只创建一次；工厂方法中可以访问其他延迟属性。
+    """
+
+    _lock = threading.RLock()
+
+    def __init__(self, factory):
+        self.factory = factory
+        self.name = factory.__name__
+        self.__doc__ = factory.__doc__
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        with self._lock:
+            if self.name not in instance.__dict__:
+                instance.__dict__[self.name] = self.factory(instance)
+            return instance.__dict__[self.name]
+
+
+def is_created(instance, name: str) -> bool:
+    """延迟属性是否已经创建（用于关闭时跳过从未使用的子系统）"""
+    return name in instance.__dict__
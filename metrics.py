@@ -0,0 +1,152 @@
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Tuple
+
+from .request_trace import record_stage
+
+# 耗时直方图的桶上界（秒）
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, float("inf"))
+
+PREFIX = "sf2cow"
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.total += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """按桶线性插值估算分位数"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        cumulative = 0
+        lower = 0.0
+        for bound, n in zip(BUCKETS, self.counts):
+            if n and cumulative + n >= rank:
+                if bound == float("inf"):
+                    return lower
+                return lower + (bound - lower) * (rank - cumulative) / n
+            cumulative += n
+            lower = bound if bound != float("inf") else lower
+        return lower
+
+
+def _labels_key(labels: Dict[str, str]) -> Tuple[Tuple[str, str], ...]:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(key, extra: str = "") -> str:
+    parts = [f'{k}="{v}"' for k, v in key]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Metrics:
+    """各阶段耗时直方图（按阶段、模型、结果区分）和计数器，可输出 Prometheus 文本格式"""
+
+    def __init__(self, is_known_model: Callable[[str], bool] = None):
+        # 模型名来自用户输入，未知模型统一记为 other，避免任意 --m 参数产生无限多的指标序列
+        self.is_known_model = is_known_model
+        self._lock = threading.Lock()
+        self._histograms: Dict[tuple, Histogram] = {}
+        self._counters: Dict[str, Dict[tuple, float]] = {}
+
+    def _model_label(self, model: str) -> str:
+        if not model:
+            return "-"
+        if self.is_known_model is not None and not self.is_known_model(model):
+            return "other"
+        return model
+
+    def observe(self, stage: str, model: str, outcome: str, seconds: float):
+        key = _labels_key({"stage": stage, "model": self._model_label(model), "outcome": outcome})
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    def inc(self, name: str, labels: Dict[str, str] = None, value: float = 1):
+        if labels and "model" in labels:
+            labels = dict(labels, model=self._model_label(labels["model"]))
+        key = _labels_key(labels or {})
+        with self._lock:
+            counter = self._counters.setdefault(name, {})
+            counter[key] = counter.get(key, 0) + value
+
+    @contextmanager
+    def timer(self, stage: str, model: str = ""):
+        """记录代码块耗时（同时计入当前请求的追踪记录）；抛出异常时结果记为 error 并计入错误数"""
+        start = time.perf_counter()
+        outcome = "ok"
+        try:
+            yield
+        except BaseException:
+            outcome = "error"
+            self.inc("errors", {"stage": stage, "model": model or "-"})
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            self.observe(stage, model, outcome, elapsed)
+            record_stage(stage, elapsed)
+
+    def render_prometheus(self) -> str:
+        lines = [f"# TYPE {PREFIX}_stage_seconds histogram"]
+        with self._lock:
+            histograms = [(key, list(h.counts), h.total, h.count) for key, h in self._histograms.items()]
+            counters = {name: dict(values) for name, values in self._counters.items()}
+        for key, counts, total, count in sorted(histograms):
+            cumulative = 0
+            for bound, n in zip(BUCKETS, counts):
+                cumulative += n
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                labels = _format_labels(key, 'le="%s"' % le)
+                lines.append(f"{PREFIX}_stage_seconds_bucket{labels} {cumulative}")
+            lines.append(f"{PREFIX}_stage_seconds_sum{_format_labels(key)} {total:.6f}")
+            lines.append(f"{PREFIX}_stage_seconds_count{_format_labels(key)} {count}")
+        for name, values in sorted(counters.items()):
+            lines.append(f"# TYPE {PREFIX}_{name}_total counter")
+            for key, value in sorted(values.items()):
+                lines.append(f"{PREFIX}_{name}_total{_format_labels(key)} {value:g}")
+        return "\n".join(lines) + "\n"
+
+    def export(self, path: str):
+        """原子地写出 Prometheus 文本文件，供 node_exporter textfile collector 等采集"""
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".metrics-")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(self.render_prometheus())
+        os.replace(tmp_path, path)
+
+    def summary(self) -> List[str]:
+        """供 $sf_stats 展示的可读摘要"""
+        lines = []
+        with self._lock:
+            items = sorted(self._histograms.items())
+            counters = {name: dict(values) for name, values in self._counters.items()}
+        for key, h in items:
+            labels = dict(key)
+            lines.append(
+                f"{labels['stage']}/{labels['model']}/{labels['outcome']}: {h.count}次 "
+                f"p50={h.quantile(0.5):.2f}s p95={h.quantile(0.95):.2f}s p99={h.quantile(0.99):.2f}s"
+            )
+        for name, values in sorted(counters.items()):
+            for key, value in sorted(values.items()):
+                label_text = ",".join(f"{k}={v}" for k, v in key)
+                lines.append(f"{name}{'(' + label_text + ')' if label_text else ''}: {value:g}")
+        return lines
@@ -0,0 +1,244 @@
+import json
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from common.log import logger
+
+
+DEFAULT_API_BASE = "https://api.siliconflow.cn/v1"
+
+DEFAULT_RATIO_TABLES = {
+    "common": {
+        "1:1": "1024x1024",
+        "9:16": "1152x2048",
+        "16:9": "2048x1152",
+        "3:2": "1536x1024",
+        "2:3": "1024x2048",
+        "4:3": "1536x2048",
+    },
+    "special": {
+        "1:1": "1024x1024",
+        "9:16": "576x1024",
+        "16:9": "1024x576",
+        "3:2": "768x512",
+        "2:3": "512x1024",
+        "4:3": "768x1024",
+    },
+}
+
+# 内置模型定义，config.json 的 models 可以按字段覆盖或新增模型，接口地址中的 {api_base} 替换为配置的 api_base
+# text_url/params：文生图接口与请求参数；img_url/img_params：图生图接口与请求参数
+# ratios：使用的尺寸表；enhancer：flux/default/none；tier：free/paid
+# max_batch/img_max_batch：文生图/图生图单次请求最多生成的图片数；turbo：少步数的快速模型，不需要生成预览
+DEFAULT_MODELS = {
+    "dev": {
+        "text_url": "{api_base}/image/generations",
+        "params": {"model": "black-forest-labs/FLUX.1-dev", "num_inference_steps": 30, "guidance_scale": 3.5},
+        "enhancer": "flux",
+        "tier": "paid",
+        "description": "FLUX.1-dev",
+    },
+    "flux": {
+        "text_url": "{api_base}/black-forest-labs/FLUX.1-schnell/text-to-image",
+        "params": {"num_inference_steps": 25, "guidance_scale": 3.5},
+        "enhancer": "flux",
+        "hidden": True,
+        "description": "FLUX.1-schnell",
+    },
+    "schnell": {
+        "text_url": "{api_base}/black-forest-labs/FLUX.1-schnell/text-to-image",
+        "params": {"num_inference_steps": 20, "guidance_scale": 3.5},
+        "description": "FLUX.1-schnell",
+    },
+    "sd35": {
+        "text_url": "{api_base}/images/generations",
+        "params": {"model": "stabilityai/stable-diffusion-3-5-large", "num_inference_steps": 30, "guidance_scale": 4.5},
+        "ratios": "special",
+        "tier": "paid",
+        "max_batch": 4,
+        "description": "stable-diffusion-3-5-large",
+    },
+    "sd3": {
+        "text_url": "{api_base}/stabilityai/stable-diffusion-3-medium/text-to-image",
+        "params": {"num_inference_steps": 30, "guidance_scale": 4.5},
+        "max_batch": 4,
+        "description": "Stable Diffusion 3 Medium",
+    },
+    "sdxl": {
+        "text_url": "{api_base}/stabilityai/stable-diffusion-xl-base-1.0/text-to-image",
+        "params": {"num_inference_steps": 25, "guidance_scale": 3.5},
+        "img_url": "{api_base}/stabilityai/stable-diffusion-xl-base-1.0/image-to-image",
+        "img_params": {"num_inference_steps": 30, "guidance_scale": 7.0},
+        "max_batch": 4,
+        "description": "Stable Diffusion XL Base 1.0",
+    },
+    "sd2": {
+        "text_url": "{api_base}/stabilityai/stable-diffusion-2-1/text-to-image",
+        "params": {"num_inference_steps": 25, "guidance_scale": 6.0},
+        "img_url": "{api_base}/stabilityai/stable-diffusion-2-1/image-to-image",
+        "img_params": {"num_inference_steps": 30, "guidance_scale": 7.0},
+        "max_batch": 4,
+        "description": "Stable Diffusion 2.1",
+    },
+    "sdt": {
+        "text_url": "{api_base}/stabilityai/sd-turbo/text-to-image",
+        "params": {"num_inference_steps": 6, "guidance_scale": 1.0, "cfg_scale": 1.0},
+        "max_batch": 4,
+        "turbo": True,
+        "description": "Stable Diffusion Turbo",
+    },
+    "sdxlt": {
+        "text_url": "{api_base}/stabilityai/sdxl-turbo/text-to-image",
+        "params": {"num_inference_steps": 4, "guidance_scale": 1.0},
+        "max_batch": 4,
+        "turbo": True,
+        "description": "Stable Diffusion XL Turbo",
+    },
+    "sdxll": {
+        "text_url": "{api_base}/ByteDance/SDXL-Lightning/text-to-image",
+        "params": {"num_inference_steps": 4, "guidance_scale": 1.0},
+        "img_url": "{api_base}/ByteDance/SDXL-Lightning/image-to-image",
+        "img_params": {"num_inference_steps": 4, "guidance_scale": 1.0},
+        "max_batch": 4,
+        "turbo": True,
+        "description": "SDXL-Lightning",
+    },
+    "pm": {
+        "img_url": "{api_base}/TencentARC/PhotoMaker/image-to-image",
+        "img_params": {"style_name": "Photographic (Default)", "guidance_scale": 5, "style_strengh_radio": 20},
+        "description": "PhotoMaker（仅图生图）",
+    },
+}
+
+# 未知模型的兜底：文生图走 schnell 接口，图生图走 sdxl 接口
+FALLBACK_TEXT = ("schnell", {"num_inference_steps": 25, "guidance_scale": 3.5})
+FALLBACK_IMG = ("sdxl", {"num_inference_steps": 30, "guidance_scale": 7.5})
+
+
+class ModelSpec:
+    def __init__(self, key: str, spec: dict, ratio_tables: Dict[str, Dict[str, str]]):
+        self.key = key
+        self.text_url = spec.get("text_url")
+        self.text_template = dict(spec.get("params", {}))
+        self.img_url = spec.get("img_url")
+        self.img_template = dict(spec.get("img_params", {}))
+        self.max_batch = max(1, int(spec.get("max_batch", 1)))
+        self.img_max_batch = max(1, int(spec.get("img_max_batch", 4)))
+        self.ratio_table = ratio_tables.get(spec.get("ratios", "common"), ratio_tables["common"])
+        self.enhancer = spec.get("enhancer", "default")
+        self.tier = spec.get("tier", "free")
+        self.hidden = bool(spec.get("hidden", False))
+        self.turbo = bool(spec.get("turbo", False))
+        self.description = spec.get("description", key)
+
+
+class ModelRegistry:
+    """模型注册表：从配置加载一次，之后按模型键 O(1) 查到接口、请求模板和尺寸表，配置文件变化时自动重新加载"""
+
+    def __init__(self, conf: dict, config_path: str = None, config_section: str = None, reload_interval: float = 5):
+        # config_section 不为空时 config_path 是宿主的 plugins/config.json，本插件的配置在该段中
+        self.config_path = config_path
+        self.config_section = config_section
+        self.reload_interval = reload_interval
+        self._lock = threading.Lock()
+        self._mtime = self._stat_config()
+        self._next_check = time.monotonic() + reload_interval
+        self._build(conf)
+
+    def _stat_config(self) -> Optional[float]:
+        if not self.config_path:
+            return None
+        try:
+            return os.path.getmtime(self.config_path)
+        except OSError:
+            return None
+
+    def _build(self, conf: dict):
+        ratio_tables = {name: dict(table) for name, table in DEFAULT_RATIO_TABLES.items()}
+        ratio_tables.update(conf.get("ratio_tables", {}))
+
+        merged = {key: dict(spec) for key, spec in DEFAULT_MODELS.items()}
+        for key, spec in conf.get("models", {}).items():
+            merged.setdefault(key, {}).update(spec)
+        api_base = conf.get("api_base", DEFAULT_API_BASE).rstrip("/")
+        for spec in merged.values():
+            for field in ("text_url", "img_url"):
+                if spec.get(field):
+                    spec[field] = spec[field].replace("{api_base}", api_base)
+
+        models = {key: ModelSpec(key, spec, ratio_tables) for key, spec in merged.items()}
+        text_fallback = ModelSpec("", {"text_url": merged[FALLBACK_TEXT[0]]["text_url"], "params": FALLBACK_TEXT[1]}, ratio_tables)
+        img_fallback = ModelSpec("", {"img_url": merged[FALLBACK_IMG[0]]["img_url"], "img_params": FALLBACK_IMG[1]}, ratio_tables)
+        # 整体替换引用，读取方无需加锁
+        self._state = (models, ratio_tables, text_fallback, img_fallback)
+
+    def maybe_reload(self):
+        """节流地检查配置文件修改时间，变化时重新加载"""
+        if not self.config_path or time.monotonic() < self._next_check:
+            return
+        with self._lock:
+            self._next_check = time.monotonic() + self.reload_interval
+            mtime = self._stat_config()
+            if mtime == self._mtime:
+                return
+            self._mtime = mtime
+            try:
+                # 直接读取文件：宿主的 load_config 会缓存首次读取的配置，看不到之后的修改
+                with open(self.config_path, encoding="utf-8") as f:
+                    conf = json.load(f) or {}
+                if self.config_section:
+                    if self.config_section not in conf:
+                        raise KeyError(f"{self.config_path} 中没有 {self.config_section} 的配置")
+                    conf = conf[self.config_section] or {}
+                self._build(conf)
+                logger.info("[Siliconflow2cow] 检测到配置文件变化，已重新加载模型注册表")
+            except Exception as e:
+                logger.error(f"[Siliconflow2cow] 重新加载模型注册表失败，继续使用旧配置，错误：{e}")
+
+    def get(self, model_key: str) -> Optional[ModelSpec]:
+        return self._state[0].get(model_key)
+
+    def text_request(self, model_key: str) -> Tuple[str, dict]:
+        """返回文生图接口和请求参数模板"""
+        models, _, text_fallback, _ = self._state
+        spec = models.get(model_key)
+        if spec is None or not spec.text_url:
+            spec = text_fallback
+        return spec.text_url, spec.text_template
+
+    def img_request(self, model_key: str) -> Tuple[str, dict]:
+        """返回图生图接口和请求参数模板"""
+        models, _, _, img_fallback = self._state
+        spec = models.get(model_key)
+        if spec is None or not spec.img_url:
+            spec = img_fallback
+        return spec.img_url, spec.img_template
+
+    def size_for(self, model_key: str, ratio: str, default: str = "1024x1024") -> str:
+        models, ratio_tables, _, _ = self._state
+        spec = models.get(model_key)
+        table = spec.ratio_table if spec else ratio_tables["common"]
+        return table.get(ratio, default)
+
+    def max_batch_for(self, model_key: str, img2img: bool = False) -> int:
+        """单次请求最多生成的图片数，未知模型按 1 张处理"""
+        spec = self.get(model_key)
+        if spec is None:
+            return 1
+        return spec.img_max_batch if img2img else spec.max_batch
+
+    def is_turbo(self, model_key: str) -> bool:
+        spec = self.get(model_key)
+        return bool(spec and spec.turbo)
+
+    def enhancer_for(self, model_key: str) -> str:
+        spec = self.get(model_key)
+        return spec.enhancer if spec else "default"
+
+    def visible_models(self) -> List[ModelSpec]:
+        return [spec for spec in self._state[0].values() if not spec.hidden]
+
+    def ratios(self) -> List[str]:
+        return list(self._state[1]["common"].keys())
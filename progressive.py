@@ -0,0 +1,41 @@
+import threading
+import time
+from typing import Optional, Tuple
+
+
+def preview_size(image_size: str, max_side: int = 512) -> str:
+    """按比例把尺寸缩小到最长边不超过 max_side，并对齐到 64 的倍数"""
+    width, height = map(int, image_size.split("x"))
+    scale = min(1.0, max_side / max(width, height))
+    width = max(64, int(width * scale) // 64 * 64)
+    height = max(64, int(height * scale) // 64 * 64)
+    return f"{width}x{height}"
+
+
+class FirstImageTracker:
+    """记录一次绘图中第一张图片（预览或最终结果）送达用户的时间"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.first_at: Optional[float] = None
+        self.first_kind = ""
+        self.finished = False
+        self._lock = threading.Lock()
+
+    def claim_preview(self) -> bool:
+        """预览图准备发送前调用；最终结果已经完成时返回 False，预览图不再发送"""
+        with self._lock:
+            if self.finished or self.first_at is not None:
+                return False
+            self.first_at = time.perf_counter()
+            self.first_kind = "preview"
+            return True
+
+    def finish(self) -> Tuple[float, str]:
+        """最终结果准备发送时调用，返回 (首图耗时, 首图类型)"""
+        with self._lock:
+            self.finished = True
+            if self.first_at is None:
+                self.first_at = time.perf_counter()
+                self.first_kind = "final"
+            return self.first_at - self.start, self.first_kind
@@ -0,0 +1,94 @@
+import hashlib
+import threading
+import time
+from typing import Iterable, Optional
+
+from common.log import logger
+
+from .shared_state import open_shared_db
+
+
+def prompt_hash(text: str) -> str:
+    return hashlib.sha256((text or "").encode("utf-8")).hexdigest()[:16]
+
+
+class PromptCache:
+    """基于 SQLite 的增强提示词缓存，按最近访问时间做 LRU 淘汰，并支持 TTL 过期"""
+
+    def __init__(self, db_path: str, max_entries: int = 5000, ttl: float = 7 * 86400):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = open_shared_db(db_path)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS prompt_cache ("
+            "key TEXT PRIMARY KEY, system_hash TEXT NOT NULL, value TEXT NOT NULL, "
+            "created REAL NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_prompt_cache_access ON prompt_cache(last_access)")
+
+    @staticmethod
+    def make_key(chat_model: str, system_hash: str, prompt: str) -> str:
+        return hashlib.sha256(f"{chat_model}\0{system_hash}\0{prompt}".encode("utf-8")).hexdigest()
+
+    def get(self, chat_model: str, system_hash: str, prompt: str) -> Optional[str]:
+        key = self.make_key(chat_model, system_hash, prompt)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT value, created FROM prompt_cache WHERE key = ?", (key,)).fetchone()
+            if row is None or now - row[1] > self.ttl:
+                if row is not None:
+                    self._conn.execute("DELETE FROM prompt_cache WHERE key = ?", (key,))
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE prompt_cache SET last_access = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            return row[0]
+
+    def put(self, chat_model: str, system_hash: str, prompt: str, value: str):
+        key = self.make_key(chat_model, system_hash, prompt)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO prompt_cache (key, system_hash, value, created, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, system_hash, value, now, now),
+            )
+            count = self._conn.execute("SELECT COUNT(*) FROM prompt_cache").fetchone()[0]
+            if count > self.max_entries:
+                # 淘汰最久未访问的条目
+                self._conn.execute(
+                    "DELETE FROM prompt_cache WHERE key IN (SELECT key FROM prompt_cache ORDER BY last_access LIMIT ?)",
+                    (count - self.max_entries,),
+                )
+
+    def retain_system_hashes(self, valid_hashes: Iterable[str]) -> int:
+        """删除由已失效的增强提示词生成的条目，返回删除数量"""
+        valid = list(set(valid_hashes))
+        placeholders = ",".join("?" * len(valid))
+        with self._lock:
+            cursor = self._conn.execute(f"DELETE FROM prompt_cache WHERE system_hash NOT IN ({placeholders})", valid)
+        if cursor.rowcount:
+            logger.info(f"[Siliconflow2cow] 增强提示词已变更，清除 {cursor.rowcount} 条过期缓存")
+        return cursor.rowcount
+
+    def purge_expired(self) -> int:
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM prompt_cache WHERE created < ?", (time.time() - self.ttl,))
+        return cursor.rowcount
+
+    def stats(self) -> dict:
+        with self._lock:
+            size = self._conn.execute("SELECT COUNT(*) FROM prompt_cache").fetchone()[0]
+        total = self.hits + self.misses
+        return {
+            "size": size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
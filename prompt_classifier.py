@@ -0,0 +1,80 @@
+import re
+from typing import Tuple
+
+
+# 未按模型配置时的默认阈值：
+#   enabled              是否启用本地判断
+#   max_non_latin_ratio  非拉丁字母（中文等）占比超过该值时需要 LLM 翻译
+#   short_max_tokens     不超过该词数的简短英文提示词只做本地整理
+#   detailed_min_tokens  达到该词数的英文提示词视为已足够详细，直接使用
+#   keyword_min_tokens / min_keyword_density  词数达到前者且绘图关键词占比达到后者时直接使用
+#   normalize_suffix     本地整理时追加的质量描述，留空不追加
+DEFAULT_THRESHOLDS = {
+    "enabled": True,
+    "max_non_latin_ratio": 0.05,
+    "short_max_tokens": 2,
+    "detailed_min_tokens": 40,
+    "keyword_min_tokens": 6,
+    "min_keyword_density": 0.25,
+    "normalize_suffix": "",
+}
+
+# 判断结果：原样使用、本地整理、调用 LLM 增强
+PASSTHROUGH = "passthrough"
+NORMALIZE = "normalize"
+ENHANCE = "enhance"
+
+# 常见的 Stable Diffusion 提示词用语
+PROMPT_KEYWORDS = frozenset("""
+masterpiece quality best high highly detailed detail details intricate ultra 4k 8k hdr uhd resolution
+photorealistic realistic hyperrealistic photorealism photography photo cinematic lighting light illumination
+volumetric dramatic soft rim studio golden hour bokeh depth field focus sharp blur render rendered octane
+unreal engine raytracing artstation trending concept art illustration digital painting oil watercolor
+sketch anime style portrait landscape closeup close-up wide angle shot lens mm composition vibrant
+texture textures atmosphere atmospheric moody symmetrical elegant award winning
+""".split())
+
+_URL = re.compile(r"https?://\S+")
+_TOKEN = re.compile(r"[A-Za-z][A-Za-z'-]*|\d+[a-zA-Z]*")
+_WEIGHTED = re.compile(r"\([^()]+:\d+(?:\.\d+)?\)")
+
+
+def prompt_features(prompt: str) -> dict:
+    """提取用于判断的特征：非拉丁字母占比、英文词数、绘图关键词占比"""
+    text = _URL.sub(" ", prompt)
+    letters = [ch for ch in text if ch.isalpha()]
+    non_latin = sum(1 for ch in letters if ord(ch) > 0x24F)
+    tokens = _TOKEN.findall(text)
+    keywords = sum(1 for token in tokens if token.lower() in PROMPT_KEYWORDS)
+    # (word:1.2) 形式的权重语法只出现在写好的绘图提示词里
+    keywords += len(_WEIGHTED.findall(text))
+    return {
+        "non_latin_ratio": non_latin / len(letters) if letters else 0.0,
+        "tokens": len(tokens),
+        "keyword_density": min(1.0, keywords / len(tokens)) if tokens else 0.0,
+    }
+
+
+def classify_prompt(prompt: str, thresholds: dict) -> Tuple[str, dict]:
+    """判断提示词是否需要 LLM 增强，返回 (判断结果, 特征)"""
+    features = prompt_features(prompt)
+    if not thresholds.get("enabled", True) or not features["tokens"]:
+        return ENHANCE, features
+    if features["non_latin_ratio"] > thresholds["max_non_latin_ratio"]:
+        # 增强同时负责翻译
+        return ENHANCE, features
+    if features["tokens"] <= thresholds["short_max_tokens"]:
+        return NORMALIZE, features
+    if features["tokens"] >= thresholds["detailed_min_tokens"]:
+        return PASSTHROUGH, features
+    if features["tokens"] >= thresholds["keyword_min_tokens"] and features["keyword_density"] >= thresholds["min_keyword_density"]:
+        return PASSTHROUGH, features
+    return ENHANCE, features
+
+
+def normalize_prompt(prompt: str, suffix: str = "") -> str:
+    """本地整理：合并空白、去掉首尾多余的标点，按配置追加质量描述"""
+    text = re.sub(r"\s+", " ", prompt).strip().strip(",.;，。；")
+    if suffix and suffix.lower() not in text.lower():
+        text = f"{text}, {suffix}"
+    return text
@@ -0,0 +1,177 @@
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+from .shared_state import open_shared_db
+
+
+class QuotaExceeded(Exception):
+    """超出使用限制，异常信息即回复给用户的文案"""
+
+
+class Reservation:
+    """一次已预扣的额度，生成失败时用于退还"""
+
+    def __init__(self, user: str, model_key: str, units: float, period: float):
+        self.user = user
+        self.model_key = model_key
+        self.units = units
+        self.period = period
+
+
+class QuotaEngine:
+    """按用户和模型限制使用次数，支持每日、滑动窗口和令牌桶三种策略，状态保存在 WAL 模式的 SQLite 中
+
+    每条限制规则形如：
+        {"policy": "daily", "limit": 10}
+        {"policy": "sliding", "limit": 5, "window": 3600}
+        {"policy": "bucket", "capacity": 10, "refill_per_hour": 5}
+    """
+
+    def __init__(self, db_path: str, limits: Dict[str, dict], daily_reset_time: str = "00:00"):
+        self.limits = limits
+        self.reset_hour, self.reset_minute = map(int, daily_reset_time.split(":"))
+        self.next_reset = self._compute_next_reset(time.time())
+        self._lock = threading.Lock()
+        self._conn = open_shared_db(db_path)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS quota ("
+            "user TEXT NOT NULL, model TEXT NOT NULL, period REAL NOT NULL, used REAL NOT NULL, prev REAL NOT NULL, "
+            "PRIMARY KEY (user, model))"
+        )
+
+    def _compute_next_reset(self, now: float) -> float:
+        current = datetime.fromtimestamp(now)
+        reset_time = current.replace(hour=self.reset_hour, minute=self.reset_minute, second=0, microsecond=0)
+        if reset_time <= current:
+            reset_time += timedelta(days=1)
+        return reset_time.timestamp()
+
+    def _daily_period(self, now: float) -> float:
+        # 只有越过预先计算好的刷新时间时才重新计算
+        if now >= self.next_reset:
+            self.next_reset = self._compute_next_reset(now)
+        return self.next_reset
+
+    def reserve(self, user: str, model_key: str, units: float = 1) -> Optional[Reservation]:
+        """原子地检查并预扣额度；模型没有限制时返回 None，超出限制时抛出 QuotaExceeded"""
+        rule = self.limits.get(model_key)
+        if not rule:
+            return None
+        policy = rule.get("policy", "daily")
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT period, used, prev FROM quota WHERE user = ? AND model = ?", (user, model_key)
+                ).fetchone()
+                if policy == "bucket":
+                    period, used, prev = self._reserve_bucket(rule, row, units, now, model_key)
+                elif policy == "sliding":
+                    period, used, prev = self._reserve_sliding(rule, row, units, now, model_key)
+                else:
+                    period, used, prev = self._reserve_daily(rule, row, units, now, model_key)
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO quota (user, model, period, used, prev) VALUES (?, ?, ?, ?, ?)",
+                    (user, model_key, period, used, prev),
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return Reservation(user, model_key, units, period)
+
+    def _reserve_daily(self, rule, row, units, now, model_key):
+        limit = float(rule.get("limit", 0))
+        period = self._daily_period(now)
+        used = row[1] if row and row[0] == period else 0
+        if used + units > limit:
+            raise QuotaExceeded(f"您今天使用 {model_key} 模型的次数已达上限 ({int(limit)} 次)。")
+        return period, used + units, 0
+
+    def _reserve_sliding(self, rule, row, units, now, model_key):
+        # 滑动窗口计数：用上一个窗口的计数按剩余比例加权估算，O(1) 存储
+        limit = float(rule.get("limit", 0))
+        window = float(rule.get("window", 3600))
+        period = now - now % window
+        if row and row[0] == period:
+            used, prev = row[1], row[2]
+        elif row and row[0] == period - window:
+            used, prev = 0, row[1]
+        else:
+            used, prev = 0, 0
+        estimate = prev * (1 - (now - period) / window) + used
+        if estimate + units > limit:
+            raise QuotaExceeded(f"您在最近 {window / 60:.0f} 分钟内使用 {model_key} 模型的次数已达上限 ({int(limit)} 次)。")
+        return period, used + units, prev
+
+    def _reserve_bucket(self, rule, row, units, now, model_key):
+        # period 记录上次更新时间，used 记录剩余令牌数
+        capacity = float(rule.get("capacity", 1))
+        rate = float(rule.get("refill_per_hour", 1)) / 3600
+        tokens = capacity if row is None else min(capacity, row[1] + (now - row[0]) * rate)
+        if tokens < units:
+            wait = (units - tokens) / rate if rate > 0 else float("inf")
+            raise QuotaExceeded(f"您使用 {model_key} 模型过于频繁，请约 {wait:.0f} 秒后再试。")
+        return now, tokens - units, 0
+
+    def refund(self, reservation: Optional[Reservation]):
+        """生成失败时退还预扣的额度"""
+        if reservation is None:
+            return
+        rule = self.limits.get(reservation.model_key, {})
+        policy = rule.get("policy", "daily")
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                if policy == "bucket":
+                    capacity = float(rule.get("capacity", 1))
+                    self._conn.execute(
+                        "UPDATE quota SET used = MIN(?, used + ?) WHERE user = ? AND model = ?",
+                        (capacity, reservation.units, reservation.user, reservation.model_key),
+                    )
+                else:
+                    # 只退还到预扣时所在的周期，周期已切换则无需退还
+                    self._conn.execute(
+                        "UPDATE quota SET used = MAX(0, used - ?) WHERE user = ? AND model = ? AND period = ?",
+                        (reservation.units, reservation.user, reservation.model_key, reservation.period),
+                    )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def purge_stale(self) -> int:
+        """删除已经不再影响限制的记录（周期已过、窗口已滑出、令牌桶已回满），返回删除数量"""
+        now = time.time()
+        deleted = 0
+        with self._lock:
+            placeholders = ",".join("?" * len(self.limits))
+            # 已取消限制的模型
+            deleted += self._conn.execute(
+                f"DELETE FROM quota WHERE model NOT IN ({placeholders})", list(self.limits)
+            ).rowcount
+            for model_key, rule in self.limits.items():
+                policy = rule.get("policy", "daily")
+                if policy == "bucket":
+                    rate = float(rule.get("refill_per_hour", 1)) / 3600
+                    deleted += self._conn.execute(
+                        "DELETE FROM quota WHERE model = ? AND used + (? - period) * ? >= ?",
+                        (model_key, now, rate, float(rule.get("capacity", 1))),
+                    ).rowcount
+                elif policy == "sliding":
+                    window = float(rule.get("window", 3600))
+                    deleted += self._conn.execute(
+                        "DELETE FROM quota WHERE model = ? AND period < ?", (model_key, now - now % window - window)
+                    ).rowcount
+                else:
+                    deleted += self._conn.execute(
+                        "DELETE FROM quota WHERE model = ? AND period < ?", (model_key, self._daily_period(now))
+                    ).rowcount
+        return deleted
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
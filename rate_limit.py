@@ -0,0 +1,161 @@
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Callable, Dict
+
+import requests
+
+from common.log import logger
+
+from .transport import PoolTimeout
+
+
+# 视为上游限流或过载的状态码
+THROTTLE_STATUS = {429, 503}
+
+
+class UpstreamBusy(Exception):
+    """在允许的等待时间内没有拿到上游请求名额"""
+
+
+def parse_retry_after(value: str) -> float:
+    """解析 Retry-After 头（秒数或 HTTP 日期），无法解析时返回 0"""
+    if not value:
+        return 0.0
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return 0.0
+
+
+class EndpointLimiter:
+    """单个接口的并发窗口：成功时加性增大，被限流或延迟超标时乘性减小（AIMD）"""
+
+    def __init__(self, initial: float = 4, minimum: float = 1, maximum: float = 16, latency_target: float = 0):
+        self.window = float(initial)
+        self.minimum = float(minimum)
+        self.maximum = float(maximum)
+        self.latency_target = latency_target
+        self.in_flight = 0
+        self.waiting = 0
+        self.blocked_until = 0.0
+        self.throttled = 0
+        self.completed = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            self.waiting += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    if now >= deadline:
+                        return False
+                    if now < self.blocked_until:
+                        self._cond.wait(min(deadline, self.blocked_until) - now)
+                    elif self.in_flight >= int(self.window):
+                        self._cond.wait(deadline - now)
+                    else:
+                        self.in_flight += 1
+                        return True
+            finally:
+                self.waiting -= 1
+
+    def release(self, throttled: bool = False, latency: float = 0.0, retry_after: float = 0.0, neutral: bool = False):
+        """neutral=True 时只归还名额，不调整窗口（请求因自身时限结束，不能说明接口的状态）"""
+        with self._cond:
+            self.in_flight -= 1
+            if throttled:
+                self.throttled += 1
+                self.window = max(self.minimum, self.window / 2)
+                # 未给出 Retry-After 时按 1~2 秒随机暂停，避免所有等待者同时重试
+                pause = retry_after or random.uniform(1.0, 2.0)
+                self.blocked_until = max(self.blocked_until, time.monotonic() + pause)
+            elif not neutral:
+                self.completed += 1
+                if self.latency_target and latency > self.latency_target:
+                    self.window = max(self.minimum, self.window * 0.9)
+                else:
+                    self.window = min(self.maximum, self.window + 1 / self.window)
+            self._cond.notify_all()
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "window": round(self.window, 2),
+                "in_flight": self.in_flight,
+                "waiting": self.waiting,
+                "throttled": self.throttled,
+                "completed": self.completed,
+            }
+
+
+class AdmissionController:
+    """按接口 URL 控制对上游的并发，遇到 429/503 时遵循 Retry-After 排队重试而不是直接报错"""
+
+    def __init__(self, initial: float = 4, maximum: float = 16, max_wait: float = 30, max_retries: int = 3,
+                 latency_target: float = 0):
+        self.initial = initial
+        self.maximum = maximum
+        self.max_wait = max_wait
+        self.max_retries = max_retries
+        self.latency_target = latency_target
+        self._limiters: Dict[str, EndpointLimiter] = {}
+        self._lock = threading.Lock()
+
+    def limiter(self, url: str) -> EndpointLimiter:
+        with self._lock:
+            limiter = self._limiters.get(url)
+            if limiter is None:
+                limiter = EndpointLimiter(self.initial, 1, self.maximum, self.latency_target)
+                self._limiters[url] = limiter
+            return limiter
+
+    def send(self, url: str, fn: Callable[[], requests.Response], max_wait: float = None, deadline=None) -> requests.Response:
+        """在接口名额内执行 fn；被限流时在 max_wait 内等待后重试，最终仍被限流则返回最后一次响应
+
+        deadline（Deadline）为请求自身的期限：超时时期限已经用尽，说明是请求时间不够而不是接口过载，不按限流处理；
+        本地连接池已满或其他没有拿到响应的异常只归还名额，只有收到响应才计为完成。
+        """
+        limiter = self.limiter(url)
+        wait_until = time.monotonic() + (self.max_wait if max_wait is None else min(self.max_wait, max_wait))
+        attempt = 0
+        while True:
+            if not limiter.acquire(wait_until - time.monotonic()):
+                raise UpstreamBusy("当前模型请求繁忙，请稍后再试。")
+            start = time.monotonic()
+            try:
+                response = fn()
+            except requests.exceptions.Timeout as e:
+                if isinstance(e, PoolTimeout) or (deadline is not None and deadline.expired()):
+                    limiter.release(neutral=True)
+                else:
+                    limiter.release(throttled=True)
+                raise
+            except BaseException:
+                limiter.release(neutral=True)
+                raise
+            latency = time.monotonic() - start
+            if response.status_code not in THROTTLE_STATUS:
+                limiter.release(latency=latency)
+                return response
+
+            retry_after = parse_retry_after(response.headers.get("Retry-After"))
+            limiter.release(throttled=True, retry_after=retry_after)
+            attempt += 1
+            if attempt > self.max_retries or time.monotonic() + retry_after >= wait_until:
+                return response
+            logger.warning(f"[Siliconflow2cow] 接口 {url} 返回 {response.status_code}，等待 {retry_after:.1f}s 后第 {attempt} 次重试")
+
+    def format_stats(self) -> str:
+        with self._lock:
+            items = list(self._limiters.items())
+        return "\n".join(
+            f"{url}: " + ", ".join(f"{k}={v}" for k, v in limiter.stats().items()) for url, limiter in items
+        )
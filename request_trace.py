@@ -0,0 +1,106 @@
+import json
+import random
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional
+
+from common.log import logger
+
+
+_local = threading.local()
+
+
+class RequestTrace:
+    """单个绘图请求的结构化记录：请求信息、各阶段累计耗时和结果，请求结束时按采样决定是否输出"""
+
+    def __init__(self, **fields):
+        self.request_id = uuid.uuid4().hex[:12]
+        self.fields = fields
+        self.stages: Dict[str, float] = {}
+        self.start = time.perf_counter()
+        # 异步模式下任务提交到队列的时间，用于统计排队耗时
+        self.queued_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def set(self, **fields):
+        self.fields.update(fields)
+
+    def add_stage(self, stage: str, seconds: float):
+        # 并行下载等阶段会在多个线程中累加
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def to_event(self, outcome: str) -> dict:
+        with self._lock:
+            stages = {stage: round(seconds, 3) for stage, seconds in self.stages.items()}
+        return {
+            "id": self.request_id,
+            **self.fields,
+            "outcome": outcome,
+            "total": round(time.perf_counter() - self.start, 3),
+            "stages": stages,
+        }
+
+
+def current_trace() -> Optional[RequestTrace]:
+    return getattr(_local, "trace", None)
+
+
+@contextmanager
+def activate(trace: Optional[RequestTrace]):
+    """在当前线程内把 trace 设为当前请求，期间 Metrics.timer 记录的阶段耗时会计入该请求"""
+    previous = getattr(_local, "trace", None)
+    _local.trace = trace
+    try:
+        yield trace
+    finally:
+        _local.trace = previous
+
+
+def record_stage(stage: str, seconds: float):
+    trace = getattr(_local, "trace", None)
+    if trace is not None:
+        trace.add_stage(stage, seconds)
+
+
+def bind(fn: Callable) -> Callable:
+    """让提交到线程池的函数继续记录到当前请求"""
+    trace = current_trace()
+    if trace is None:
+        return fn
+
+    def run(*args, **kwargs):
+        with activate(trace):
+            return fn(*args, **kwargs)
+    return run
+
+
+class Tracer:
+    """请求结束时决定是否输出追踪事件：按 sample_rate 随机采样，失败和超过 slow_seconds 的请求总是输出"""
+
+    def __init__(self, sample_rate: float = 0.01, slow_seconds: float = 0, always_errors: bool = True,
+                 emit: Callable[[dict], None] = None):
+        self.sample_rate = sample_rate
+        self.slow_seconds = slow_seconds
+        self.always_errors = always_errors
+        self.emit = emit or self._log
+        self.emitted = 0
+
+    @staticmethod
+    def _log(event: dict):
+        logger.info("[Siliconflow2cow] trace %s", json.dumps(event, ensure_ascii=False, separators=(",", ":")))
+
+    def should_emit(self, outcome: str, total: float) -> bool:
+        if self.always_errors and outcome != "ok":
+            return True
+        if self.slow_seconds and total >= self.slow_seconds:
+            return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def finish(self, trace: RequestTrace, outcome: str):
+        if not self.should_emit(outcome, time.perf_counter() - trace.start):
+            return
+        self.emitted += 1
+        self.emit(trace.to_event(outcome))
@@ -0,0 +1,170 @@
+import os
+import threading
+import time
+from typing import Tuple
+
+from common.log import logger
+
+from .image_store import TEMP_PREFIX
+from .shared_state import open_shared_db
+
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp", ".gif", ".bmp")
+
+
+def is_image_file(entry: os.DirEntry) -> bool:
+    """目录中已保存完成的图片（跳过 ImageStore 正在写入的临时文件）"""
+    return entry.is_file() and entry.name.lower().endswith(IMAGE_EXTENSIONS) and not entry.name.startswith(TEMP_PREFIX)
+
+# 每批处理的过期条目数
+BATCH_SIZE = 500
+
+
+class RetentionManager:
+    """图片保留策略：用按过期时间排序的清单代替目录扫描，支持按年龄过期和总字节数上限的 LRU 淘汰"""
+
+    def __init__(self, root_dir: str, manifest_path: str, max_age: float, max_bytes: int = 0,
+                 reconcile_interval: float = 86400):
+        self.root_dir = root_dir
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self.reconcile_interval = reconcile_interval
+        self.last_reconcile = 0.0
+        self._lock = threading.Lock()
+        self._conn = open_shared_db(manifest_path)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS manifest ("
+            "filename TEXT PRIMARY KEY, size INTEGER NOT NULL, last_access REAL NOT NULL, expires REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_manifest_expires ON manifest(expires)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_manifest_access ON manifest(last_access)")
+        self._missing = 0
+
+    def add(self, file_path: str):
+        """登记新保存（或再次保存）的图片"""
+        now = time.time()
+        size = os.path.getsize(file_path)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO manifest (filename, size, last_access, expires) VALUES (?, ?, ?, ?)",
+                (os.path.basename(file_path), size, now, now + self.max_age),
+            )
+
+    def touch(self, file_path: str):
+        """图片被复用时刷新访问时间并顺延过期时间"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "UPDATE manifest SET last_access = ?, expires = ? WHERE filename = ?",
+                (now, now + self.max_age, os.path.basename(file_path)),
+            )
+        try:
+            os.utime(file_path)
+        except OSError:
+            pass
+
+    def run(self) -> int:
+        """删除过期图片，并在超出总大小上限时按最久未访问淘汰，返回删除数量"""
+        if time.time() - self.last_reconcile > self.reconcile_interval or self._missing > BATCH_SIZE:
+            self.rebuild()
+
+        deleted = 0
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT filename FROM manifest WHERE expires <= ? ORDER BY expires LIMIT ?", (time.time(), BATCH_SIZE)
+                ).fetchall()
+            if not rows:
+                break
+            deleted += self._remove([row[0] for row in rows])
+
+        if self.max_bytes > 0:
+            while True:
+                with self._lock:
+                    total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM manifest").fetchone()[0]
+                    if total <= self.max_bytes:
+                        break
+                    rows = self._conn.execute(
+                        "SELECT filename, size FROM manifest ORDER BY last_access LIMIT ?", (BATCH_SIZE,)
+                    ).fetchall()
+                victims = []
+                for filename, size in rows:
+                    victims.append(filename)
+                    total -= size
+                    if total <= self.max_bytes:
+                        break
+                deleted += self._remove(victims)
+        return deleted
+
+    def _remove(self, filenames) -> int:
+        removed = 0
+        for filename in filenames:
+            file_path = os.path.join(self.root_dir, filename)
+            try:
+                os.remove(file_path)
+                removed += 1
+                logger.info(f"[Siliconflow2cow] 已删除旧图片: {file_path}")
+            except FileNotFoundError:
+                # 清单与目录不一致，累计到一定数量后触发重建
+                self._missing += 1
+            except OSError as e:
+                logger.warning(f"[Siliconflow2cow] 删除图片失败: {file_path}，错误：{e}")
+        with self._lock:
+            self._conn.executemany("DELETE FROM manifest WHERE filename = ?", [(f,) for f in filenames])
+        return removed
+
+    def rebuild(self) -> int:
+        """扫描一次目录重建清单，返回登记的图片数量"""
+        start = time.time()
+        entries = []
+        with os.scandir(self.root_dir) as it:
+            for entry in it:
+                if is_image_file(entry):
+                    stat = entry.stat()
+                    entries.append((entry.name, stat.st_size, stat.st_mtime, stat.st_mtime + self.max_age))
+        scanned = {entry[0] for entry in entries}
+        with self._lock:
+            self._conn.execute("BEGIN")
+            # 扫描开始后新登记的图片不在本次扫描结果中，不能当作失效条目删除
+            stale = [
+                (row[0],) for row in self._conn.execute("SELECT filename FROM manifest WHERE last_access < ?", (start,))
+                if row[0] not in scanned
+            ]
+            self._conn.executemany("DELETE FROM manifest WHERE filename = ?", stale)
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO manifest (filename, size, last_access, expires) VALUES (?, ?, ?, ?)", entries
+            )
+            self._conn.execute("COMMIT")
+            self._missing = 0
+            self.last_reconcile = time.time()
+        logger.debug(f"[Siliconflow2cow] 图片清单已重建，共 {len(entries)} 张，耗时 {time.time() - start:.3f}s")
+        return len(entries)
+
+    def clear_all(self) -> Tuple[int, int]:
+        """删除目录下所有图片，返回 (已删除数量, 剩余数量)"""
+        deleted = remaining = 0
+        with os.scandir(self.root_dir) as it:
+            for entry in it:
+                if not is_image_file(entry):
+                    continue
+                try:
+                    os.remove(entry.path)
+                    deleted += 1
+                    logger.info(f"[Siliconflow2cow] 已删除图片: {entry.path}")
+                except OSError as e:
+                    remaining += 1
+                    logger.warning(f"[Siliconflow2cow] 删除图片失败: {entry.path}，错误：{e}")
+        with self._lock:
+            self._conn.execute("DELETE FROM manifest")
+        if remaining:
+            self.rebuild()
+        return deleted, remaining
+
+    def stats(self) -> dict:
+        with self._lock:
+            count, total = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM manifest").fetchone()
+        return {"images": count, "bytes": total}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,211 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Dict, List, Tuple
+
+import requests
+
+from common.log import logger
+
+from .deadline import Deadline, DeadlineExceeded
+from .rate_limit import UpstreamBusy
+
+
+# 至少有这么多条延迟样本后才使用观测到的 p95 作为对冲时机
+MIN_SAMPLES = 20
+
+
+class CircuitBreaker:
+    """连续失败 failure_threshold 次后断开 open_seconds 秒，之后放行一次试探请求，成功则恢复"""
+
+    def __init__(self, failure_threshold: int = 3, open_seconds: float = 60):
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+        self.times_opened = 0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.failures < self.failure_threshold:
+                return True
+            if time.monotonic() - self.opened_at < self.open_seconds or self.trial_in_flight:
+                return False
+            # 半开状态：只放行一个试探请求
+            self.trial_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.trial_in_flight = False
+
+    def record_neutral(self):
+        """调用没有得出接口是否可用的结论（例如请求自身时限用尽），只结束试探"""
+        with self._lock:
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self.trial_in_flight = False
+            if self.failures >= self.failure_threshold:
+                if self.failures == self.failure_threshold:
+                    self.times_opened += 1
+                self.opened_at = time.monotonic()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self.failures < self.failure_threshold:
+                return "closed"
+            return "open" if time.monotonic() - self.opened_at < self.open_seconds else "half-open"
+
+
+class ModelRouter:
+    """按模型配置的延迟目标路由文生图请求
+
+    每个模型的策略形如：
+        {"latency_target": 15, "hedge_to": "sdxll", "fallback": "sdxlt", "failure_threshold": 3, "open_seconds": 60}
+    主模型超过 min(观测 p95, latency_target) 仍未返回时向 hedge_to 发出对冲请求，采用先成功的结果；
+    主模型失败时改用 fallback，连续失败后断路器打开，期间直接使用 fallback。
+    """
+
+    def __init__(self, policies: Dict[str, dict], max_workers: int = 8, on_event: Callable[[str, dict], None] = None):
+        self.policies = policies or {}
+        self.on_event = on_event or (lambda name, labels: None)
+        self._executor = None
+        self._max_workers = max_workers
+        self._lock = threading.Lock()
+        self._latencies: Dict[str, deque] = {}
+        self._breakers: Dict[str, CircuitBreaker] = {}
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        # 对冲请求使用独立线程池，避免与 io_pool 中的批量任务互相等待
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self._max_workers, thread_name_prefix="sf2cow-hedge")
+            return self._executor
+
+    def breaker(self, model_key: str) -> CircuitBreaker:
+        with self._lock:
+            breaker = self._breakers.get(model_key)
+            if breaker is None:
+                policy = self.policies.get(model_key, {})
+                breaker = CircuitBreaker(int(policy.get("failure_threshold", 3)), float(policy.get("open_seconds", 60)))
+                self._breakers[model_key] = breaker
+            return breaker
+
+    def p95(self, model_key: str) -> float:
+        with self._lock:
+            samples = sorted(self._latencies.get(model_key, ()))
+        if len(samples) < MIN_SAMPLES:
+            return 0.0
+        return samples[int(0.95 * (len(samples) - 1))]
+
+    def _timed(self, model_key: str, call: Callable[[str], List[str]], deadline: Deadline = None) -> List[str]:
+        """执行一次调用，记录延迟和成败
+
+        请求自身时限用尽、本地名额等待超时不能说明模型不可用，不计入断路器的失败次数。
+        """
+        breaker = self.breaker(model_key)
+        start = time.monotonic()
+        try:
+            result = call(model_key)
+        except (DeadlineExceeded, UpstreamBusy):
+            breaker.record_neutral()
+            raise
+        except requests.exceptions.Timeout:
+            if deadline is not None and deadline.expired():
+                breaker.record_neutral()
+            else:
+                breaker.record_failure()
+            raise
+        except BaseException:
+            breaker.record_failure()
+            raise
+        breaker.record_success()
+        with self._lock:
+            self._latencies.setdefault(model_key, deque(maxlen=200)).append(time.monotonic() - start)
+        return result
+
+    def _hedge_delay(self, model_key: str, policy: dict) -> float:
+        target = float(policy.get("latency_target", 0))
+        observed = self.p95(model_key)
+        if target and observed:
+            return min(target, observed)
+        return target or observed
+
+    def run(self, model_key: str, call: Callable[[str], List[str]], deadline: Deadline = None) -> Tuple[str, List[str]]:
+        """按策略调用 call(模型)，返回 (实际使用的模型, 结果)；deadline 为 call 内部使用的请求期限"""
+        policy = self.policies.get(model_key)
+        if not policy:
+            return model_key, call(model_key)
+
+        fallback = policy.get("fallback")
+        if fallback and not self.breaker(model_key).allow():
+            self.on_event("fallbacks", {"model": model_key, "reason": "circuit_open"})
+            logger.warning(f"[Siliconflow2cow] 模型 {model_key} 断路器已打开，改用 {fallback}")
+            return fallback, self._timed(fallback, call, deadline)
+
+        try:
+            return self._run_hedged(model_key, policy, call, deadline)
+        except DeadlineExceeded:
+            # 请求已经没有剩余时间，备用模型也来不及
+            raise
+        except Exception as e:
+            if not fallback:
+                raise
+            self.on_event("fallbacks", {"model": model_key, "reason": "error"})
+            logger.warning(f"[Siliconflow2cow] 模型 {model_key} 请求失败（{e}），改用 {fallback}")
+            return fallback, self._timed(fallback, call, deadline)
+
+    def _run_hedged(self, model_key: str, policy: dict, call: Callable[[str], List[str]],
+                    deadline: Deadline = None) -> Tuple[str, List[str]]:
+        hedge_to = policy.get("hedge_to")
+        delay = self._hedge_delay(model_key, policy)
+        if not hedge_to or not delay:
+            return model_key, self._timed(model_key, call, deadline)
+
+        executor = self._get_executor()
+        primary = executor.submit(self._timed, model_key, call, deadline)
+        done, _ = wait([primary], timeout=delay)
+        if done or not self.breaker(hedge_to).allow():
+            return model_key, primary.result()
+
+        self.on_event("hedged", {"model": model_key, "hedge": hedge_to})
+        logger.info(f"[Siliconflow2cow] 模型 {model_key} 超过 {delay:.1f}s 未返回，向 {hedge_to} 发出对冲请求")
+        hedge = executor.submit(self._timed, hedge_to, call, deadline)
+        served = {primary: model_key, hedge: hedge_to}
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    # 落后的请求无法中断，其结果直接丢弃
+                    for loser in pending:
+                        loser.cancel()
+                    if future is hedge:
+                        self.on_event("hedge_wins", {"model": model_key, "hedge": hedge_to})
+                    return served[future], future.result()
+                error = future.exception()
+        raise error
+
+    def format_stats(self) -> str:
+        with self._lock:
+            keys = sorted(set(self._breakers) | set(self._latencies))
+        lines = []
+        for key in keys:
+            p95 = self.p95(key)
+            lines.append(f"{key}: 断路器={self.breaker(key).state}, p95={p95:.1f}s" if p95 else f"{key}: 断路器={self.breaker(key).state}")
+        return "\n".join(lines)
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
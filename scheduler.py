@@ -0,0 +1,123 @@
+import heapq
+import itertools
+import random
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from common.log import logger
+
+
+SCHEDULER_THREAD_NAME = "sf2cow-scheduler"
+
+
+class _Job:
+    def __init__(self, name: str, interval: float, fn: Callable[[], None], jitter: float):
+        self.name = name
+        self.interval = interval
+        self.fn = fn
+        self.jitter = jitter
+        self.runs = 0
+        self.failures = 0
+        self.last_duration = 0.0
+        self.next_run = 0.0
+
+    def schedule(self, now: float, delay: float = None):
+        # 在间隔上加入随机抖动，避免多个进程或任务在同一时刻扎堆执行
+        base = self.interval if delay is None else delay
+        self.next_run = now + base * (1 + random.uniform(-self.jitter, self.jitter))
+
+
+class Scheduler:
+    """插件的单个后台调度线程，按带抖动的截止时间依次运行所有周期任务
+
+    任务抛出的异常只记录日志，不影响后续调度；stop() 后线程退出，不会遗留定时器。
+    """
+
+    def __init__(self, name: str = SCHEDULER_THREAD_NAME, jitter: float = 0.1):
+        self.name = name
+        self.jitter = jitter
+        self.on_retire: Optional[Callable[[], None]] = None
+        self._jobs: Dict[str, _Job] = {}
+        self._heap: List[tuple] = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._thread: Optional[threading.Thread] = None
+
+    @staticmethod
+    def retire_existing(name: str = SCHEDULER_THREAD_NAME):
+        """停止此前实例遗留的调度线程（插件重新加载时旧实例不会被通知）"""
+        for thread in threading.enumerate():
+            scheduler = getattr(thread, "scheduler", None)
+            if thread.name == name and scheduler is not None and scheduler.on_retire:
+                logger.info("[Siliconflow2cow] 检测到旧的插件实例仍在运行，正在关闭")
+                scheduler.on_retire()
+
+    def add_job(self, name: str, interval: float, fn: Callable[[], None], initial_delay: float = None):
+        if interval <= 0:
+            return
+        job = _Job(name, interval, fn, self.jitter)
+        with self._cond:
+            job.schedule(time.monotonic(), initial_delay)
+            self._jobs[name] = job
+            heapq.heappush(self._heap, (job.next_run, next(self._seq), job))
+            self._cond.notify()
+
+    def start(self):
+        with self._cond:
+            if self._thread is not None or self._stopped:
+                return
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.scheduler = self
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._stopped:
+                    now = time.monotonic()
+                    if self._heap and self._heap[0][0] <= now:
+                        break
+                    self._cond.wait(self._heap[0][0] - now if self._heap else None)
+                if self._stopped:
+                    return
+                _, _, job = heapq.heappop(self._heap)
+
+            start = time.monotonic()
+            try:
+                job.fn()
+            except Exception as e:
+                job.failures += 1
+                logger.error(f"[Siliconflow2cow] 周期任务 {job.name} 执行失败，错误：{e}")
+            job.runs += 1
+            job.last_duration = time.monotonic() - start
+
+            with self._cond:
+                if self._stopped:
+                    return
+                job.schedule(time.monotonic())
+                heapq.heappush(self._heap, (job.next_run, next(self._seq), job))
+
+    def stop(self, timeout: float = 10):
+        """取消所有任务并等待调度线程退出（正在执行的任务会先执行完）"""
+        with self._cond:
+            self._stopped = True
+            self._heap.clear()
+            self._cond.notify_all()
+            thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout)
+
+    def stats(self) -> Dict[str, dict]:
+        now = time.monotonic()
+        with self._cond:
+            return {
+                name: {
+                    "runs": job.runs,
+                    "failures": job.failures,
+                    "last_duration": round(job.last_duration, 3),
+                    "next_in": round(max(0.0, job.next_run - now), 1),
+                }
+                for name, job in self._jobs.items()
+            }
@@ -0,0 +1,115 @@
+import os
+import pickle
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Set
+
+from common.log import logger
+
+
+def open_shared_db(db_path: str) -> sqlite3.Connection:
+    """打开可由多个线程、多个进程共享的 SQLite 数据库（WAL 模式、自动提交），调用方自行加锁串行使用连接"""
+    os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+    # 多个进程共享同一个文件时，写锁冲突最多等待 timeout 秒
+    conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None, timeout=10)
+    conn.execute("PRAGMA journal_mode=WAL")
+    return conn
+
+
+def make_instance_id() -> str:
+    """当前进程的唯一标识，用于租约归属"""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+class SharedState:
+    """多个进程共享的状态：已认证的管理员和后台任务的租约，保存在 WAL 模式的 SQLite 中
+
+    同一台机器上的多个进程指向同一个 data_dir 即可共享；SQLite 依赖文件锁，不要放在网络文件系统上。
+    """
+
+    def __init__(self, db_path: str, instance_id: str = None):
+        self.instance_id = instance_id or make_instance_id()
+        self._lock = threading.Lock()
+        self._conn = open_shared_db(db_path)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS admin_users (user TEXT PRIMARY KEY, added REAL NOT NULL)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS leases (name TEXT PRIMARY KEY, owner TEXT NOT NULL, expires REAL NOT NULL)"
+        )
+
+    def migrate_admin_pickle(self, pickle_path: str) -> int:
+        """导入旧版本保存在 admin_users.pkl 中的管理员，导入后重命名原文件"""
+        if not os.path.exists(pickle_path):
+            return 0
+        try:
+            with open(pickle_path, "rb") as f:
+                users = pickle.load(f)
+        except Exception as e:
+            logger.error(f"[Siliconflow2cow] 读取 {pickle_path} 失败，错误：{e}")
+            return 0
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO admin_users (user, added) VALUES (?, ?)", [(user, now) for user in users]
+            )
+        try:
+            os.replace(pickle_path, pickle_path + ".migrated")
+        except OSError:
+            # 其他进程已经完成迁移
+            pass
+        logger.info(f"[Siliconflow2cow] 已从 {pickle_path} 导入 {len(users)} 个管理员")
+        return len(users)
+
+    def is_admin(self, user: str) -> bool:
+        with self._lock:
+            row = self._conn.execute("SELECT 1 FROM admin_users WHERE user = ?", (user,)).fetchone()
+        return row is not None
+
+    def add_admin(self, user: str):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO admin_users (user, added) VALUES (?, ?)", (user, time.time()))
+
+    def admin_users(self) -> Set[str]:
+        with self._lock:
+            return {row[0] for row in self._conn.execute("SELECT user FROM admin_users")}
+
+    def acquire_lease(self, name: str, ttl: float) -> bool:
+        """获取或续期名为 name 的租约；租约由其他进程持有且未过期时返回 False
+
+        持有者按小于 ttl 的间隔续期即可一直保持；持有者退出后租约过期，由其他进程接管。
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute("SELECT owner, expires FROM leases WHERE name = ?", (name,)).fetchone()
+                acquired = row is None or row[0] == self.instance_id or row[1] <= now
+                if acquired:
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO leases (name, owner, expires) VALUES (?, ?, ?)",
+                        (name, self.instance_id, now + ttl),
+                    )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        if acquired and (row is None or row[0] != self.instance_id):
+            logger.info(f"[Siliconflow2cow] 实例 {self.instance_id} 获得租约 {name}")
+        return acquired
+
+    def release_lease(self, name: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM leases WHERE name = ? AND owner = ?", (name, self.instance_id))
+
+    def lease_owner(self, name: str) -> str:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT owner FROM leases WHERE name = ? AND expires > ?", (name, time.time())
+            ).fetchone()
+        return row[0] if row else ""
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
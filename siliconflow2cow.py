@@ -1,16 +1,17 @@
 import os
 import re
 import json
+import logging
 import time
 import requests
-import base64
+import math
 from io import BytesIO
-from typing import List, Tuple
-from pathvalidate import sanitize_filename
-from PIL import Image
-from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
 import threading
-import pickle
+import tracemalloc
+import atexit
+import weakref
 
 import plugins
 from bridge.context import ContextType
@@ -19,6 +20,44 @@ from common.log import logger
 from plugins import *
 from config import conf
 
+from .transport import HttpTransport
+from .worker_pool import BoundedExecutor
+from .prompt_cache import PromptCache, prompt_hash
+from .image_store import ImageStore
+from .singleflight import SingleFlight
+from .retention import RetentionManager
+from .quota import QuotaEngine, QuotaExceeded
+from .rate_limit import AdmissionController, UpstreamBusy
+from .model_registry import ModelRegistry
+from .delivery import DeliveryEncoder
+from .source_image import SourceImageProcessor
+from .metrics import Metrics
+from .shared_state import SharedState
+from .routing import ModelRouter
+from .progressive import FirstImageTracker, preview_size
+from .deadline import DEFAULT_BUDGETS, Deadline, DeadlineExceeded
+from .enhance_batcher import EnhanceBatcher, build_batch_messages, parse_batch_output
+from .scheduler import Scheduler
+from .lazy import is_created, lazy_property
+from . import request_trace
+from .request_trace import RequestTrace, Tracer
+from .fair_queue import FairScheduler, QueueLimitExceeded, Ticket
+from .prompt_classifier import DEFAULT_THRESHOLDS, ENHANCE, PASSTHROUGH, classify_prompt, normalize_prompt
+
+
+# 首次使用时才创建的子系统（lazy_init 关闭时在初始化阶段全部创建）
+LAZY_SUBSYSTEMS = ("shared_state", "quota", "transport", "source_images", "prompt_cache", "image_store", "retention")
+
+# 本插件处理的命令前缀，其余不以绘图前缀开头的消息直接交给其他插件
+COMMAND_PREFIXES = ("$set_sf_admin_password ", "$sf_admin_password ", "$sf_http_stats", "$sf_cache_stats", "$sf_stats")
+
+
+def _shutdown_on_exit(plugin_ref):
+    """进程退出时关闭仍在运行的插件实例；使用弱引用，不阻止旧实例被回收"""
+    plugin = plugin_ref()
+    if plugin is not None:
+        plugin.shutdown(timeout=5)
+
 
 @plugins.register(
     name="Siliconflow2cow",
@@ -32,7 +71,7 @@ class Siliconflow2cow(Plugin):
     def __init__(self):
         super().__init__()
         try:
-            self.conf = super().load_config()
+            self.conf = self.load_config()
             if not self.conf:
                 raise Exception("配置未找到。")
     
@@ -52,77 +91,284 @@ class Siliconflow2cow(Plugin):
             self.enhancer_prompt = self.conf.get("ENHANCER_PROMPT", "")
             self.enhancer_prompt_flux = self.conf.get("ENHANCER_PROMPT_FLUX", "")
             self.default_drawing_model = self.conf.get("default_drawing_model", "schnell")
+            # 模型注册表，宿主读取的配置文件修改后自动重新加载
+            config_path, config_section = self.config_source()
+            self.model_registry = ModelRegistry(
+                self.conf,
+                config_path=config_path,
+                config_section=config_section,
+                reload_interval=float(self.conf.get("model_registry_reload_interval", 5)),
+            )
+            # 插件运行数据（缓存、状态等）的保存目录，不随图片一起被清理
+            self.data_dir = self.conf.get("data_dir", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data"))
             self.dev_model_usage_limit = int(self.conf.get("dev_model_usage_limit", 5))  # 每日限制次数
             self.daily_reset_time = self.conf.get("daily_reset_time", "00:00")  # 每日刷新时间
-    
-            self.user_usage: Dict[str, int] = {}  # 用户使用次数记录
-            self.last_reset_date = datetime.now().date()
+
             # 加载管理员密码
             self.admin_password = self.conf.get("admin_password", "")
-            self.admin_users = self.load_admin_users()  # 加载已认证的管理员用户
-    
-            if not os.path.exists(self.image_output_dir):
-                os.makedirs(self.image_output_dir)
-    
+            # 定期清理只由持有租约的一个进程执行，持有者退出后租约过期，由其他进程接管
+            self.maintenance_lease_ttl = float(self.conf.get("maintenance_lease_ttl", self.clean_check_interval * 2 + 60))
+
+            # 各阶段耗时与计数器，可定期导出为 Prometheus 文本文件
+            self.metrics = Metrics(is_known_model=lambda key: self.model_registry.get(key) is not None)
+            self.metrics_file = self.conf.get("metrics_file", "")
+            self.metrics_export_interval = float(self.conf.get("metrics_export_interval", 60))
+            # 每个绘图请求结束时按采样输出一条结构化追踪日志，失败和慢请求总是输出
+            self.tracer = Tracer(
+                sample_rate=float(self.conf.get("trace_sample_rate", 0.01)),
+                slow_seconds=float(self.conf.get("trace_slow_seconds", 0)),
+                always_errors=bool(self.conf.get("trace_errors", True)),
+            )
+
+            # 每个绘图请求的总时限和各阶段预算，可按模型覆盖
+            self.deadline_budgets = self.conf.get("deadlines", {})
+            self.invalid_budget_models = set()
+            # 本地判断提示词是否需要增强的阈值，可按模型覆盖
+            self.fast_path_thresholds = self.conf.get("fast_path", {})
+            # 突发流量时把短时间内到达的提示词合并为一次增强请求
+            self.enhance_batcher = None
+            if self.conf.get("enhance_batch_enabled", False):
+                self.enhance_batcher = EnhanceBatcher(
+                    self.request_enhancement,
+                    self.request_batch_enhancement,
+                    window=float(self.conf.get("enhance_batch_window_ms", 100)) / 1000,
+                    max_batch=int(self.conf.get("enhance_batch_max", 8)),
+                    on_event=lambda name, labels: self.metrics.inc(name, labels),
+                )
+            # 按模型配置的延迟目标：超时对冲到更快的模型，连续失败时断路到备用模型
+            self.router = ModelRouter(
+                self.conf.get("routing", {}),
+                max_workers=int(self.conf.get("routing_workers", 8)),
+                on_event=lambda name, labels: self.metrics.inc(name, labels),
+            )
+            # 按模型接口自适应控制并发，429/503 时排队等待而不是直接报错
+            self.admission = AdmissionController(
+                initial=float(self.conf.get("upstream_initial_concurrency", 4)),
+                maximum=float(self.conf.get("upstream_max_concurrency", 16)),
+                max_wait=float(self.conf.get("upstream_max_wait", 30)),
+                max_retries=int(self.conf.get("upstream_max_retries", 3)),
+                latency_target=float(self.conf.get("upstream_latency_target", 0)),
+            )
+
+            # 相同请求直接复用已保存的生成结果
+            self.reuse_identical_results = bool(self.conf.get("reuse_identical_results", False))
+            # 多图生成：单次最多张数、回复方式（grid 拼成一张网格图 / multiple 逐张发送）
+            self.max_images_per_request = int(self.conf.get("max_images_per_request", 4))
+            self.batch_reply_mode = self.conf.get("batch_reply_mode", "grid")
+            self.contact_sheet_cell_size = int(self.conf.get("contact_sheet_cell_size", 768))
+            # 保存图片时的格式转换，留空表示保留接口返回的原始格式
+            self.image_convert_format = self.conf.get("image_convert_format", "")
+            # 发送前压缩为 WebP/JPEG，在独立进程中编码
+            self.delivery = None
+            if self.conf.get("delivery_format"):
+                self.delivery = DeliveryEncoder(
+                    fmt=self.conf.get("delivery_format"),
+                    quality=int(self.conf.get("delivery_quality", 85)),
+                    max_bytes=int(float(self.conf.get("delivery_max_kb", 0)) * 1024),
+                    max_side=int(self.conf.get("delivery_max_side", 0)),
+                    workers=int(self.conf.get("delivery_workers", 2)),
+                    on_encoded=lambda saved: self.metrics.inc("delivery_bytes_saved", value=saved),
+                )
+            # 渐进式发送：慢模型先用快速模型生成小尺寸预览图发送，最终图片完成后再发送
+            self.progressive_preview = bool(self.conf.get("progressive_preview", False))
+            self.preview_model = self.conf.get("preview_model", "sdxlt")
+            self.preview_max_side = int(self.conf.get("preview_max_side", 512))
+            # 记录每次绘图的内存峰值（tracemalloc 有额外开销，仅用于排查）
+            self.memory_profiling = bool(self.conf.get("memory_profiling", False))
+            if self.memory_profiling and not tracemalloc.is_tracing():
+                tracemalloc.start()
+            # 并行下载多张图片、拆分批量请求使用的线程池
+            self.io_pool = ThreadPoolExecutor(max_workers=int(self.conf.get("io_workers", 8)), thread_name_prefix="sf2cow-io")
+            # 合并并发的相同绘图请求
+            self.single_flight = SingleFlight()
+
+            # 异步模式：确认命令后立即返回，生成完成后再通过 channel 推送图片
+            self.async_mode = bool(self.conf.get("async_mode", False))
+            self.async_ack_message = self.conf.get("async_ack_message", "收到，正在绘制中，请稍候...")
+            self.executor = None
+            async_workers = int(self.conf.get("async_workers", 4))
+            async_queue_size = int(self.conf.get("async_queue_size", 16))
+            # 公平调度：按用户和群组加权分配绘图并发，限制单个用户同时执行和排队的任务数
+            self.fair = None
+            if self.conf.get("fair_scheduling", True):
+                self.fair = FairScheduler(
+                    capacity=int(self.conf.get("fair_concurrency", async_workers if self.async_mode else 8)),
+                    max_in_flight=int(self.conf.get("fair_user_max_in_flight", 2)),
+                    max_queued=int(self.conf.get("fair_user_max_queued", 5)),
+                    on_wait=lambda ticket, seconds: self.metrics.observe("queue_wait", "", "group" if ticket.group != ticket.user else "private", seconds),
+                )
+                self.fair_admin_weight = float(self.conf.get("fair_admin_weight", 4))
+                self.fair_model_costs = self.conf.get("fair_model_costs", {})
+            if self.async_mode:
+                # 启用公平调度时任务在公平队列中放行后才提交到线程池，排队中的任务不占用线程池名额
+                self.executor = BoundedExecutor(max_workers=async_workers, max_queue=async_queue_size)
+
             self.handlers[Event.ON_HANDLE_CONTEXT] = self.on_handle_context
-    
-            # 启动定时清理任务
-            self.schedule_next_run()
+
+            # 插件重新加载时旧实例不会收到通知，先关闭它遗留的后台线程和连接池
+            Scheduler.retire_existing()
+            self.closed = False
+            self.shutdown_timeout = float(self.conf.get("shutdown_timeout", 30))
+            # 所有周期任务由一个后台线程调度
+            self.scheduler = Scheduler(jitter=float(self.conf.get("scheduler_jitter", 0.1)))
+            self.scheduler.on_retire = self.shutdown
+            self.started = False
+            self._start_lock = threading.Lock()
+            atexit.register(_shutdown_on_exit, weakref.ref(self))
+            # 延迟初始化：数据库、图片目录和周期任务在收到第一条消息时才创建，加快插件加载
+            if not self.conf.get("lazy_init", True):
+                for name in LAZY_SUBSYSTEMS:
+                    getattr(self, name)
+                self.ensure_started()
     
             logger.info(f"[Siliconflow2cow] 初始化成功，清理间隔设置为 {self.clean_interval} 天，检查间隔为 {self.clean_check_interval} 秒")
         except Exception as e:
             logger.error(f"[Siliconflow2cow] 初始化失败，错误：{e}")
             raise e
 
-            
-    def load_admin_users(self):
-        admin_users_file = os.path.join(self.image_output_dir, "admin_users.pkl")
-        if os.path.exists(admin_users_file):
-            with open(admin_users_file, "rb") as f:
-                return pickle.load(f)
-        else:
-            return set()  # 使用集合来存储用户ID
-    
-    def save_admin_users(self):
-        admin_users_file = os.path.join(self.image_output_dir, "admin_users.pkl")
-        with open(admin_users_file, "wb") as f:
-            pickle.dump(self.admin_users, f)
 
+    @lazy_property
+    def shared_state(self) -> SharedState:
+        """已认证的管理员和后台任务租约保存在共享的 SQLite 中，多个进程可以共用同一个 data_dir"""
+        shared_state = SharedState(os.path.join(self.data_dir, "shared_state.db"))
+        shared_state.migrate_admin_pickle(os.path.join(self.image_output_dir, "admin_users.pkl"))
+        return shared_state
 
+    @lazy_property
+    def quota(self) -> QuotaEngine:
+        """按用户和模型的使用限制，未配置 quota_limits 时沿用 dev 模型每日次数限制"""
+        quota_limits = self.conf.get("quota_limits") or {"dev": {"policy": "daily", "limit": self.dev_model_usage_limit}}
+        return QuotaEngine(os.path.join(self.data_dir, "quota.db"), quota_limits, self.daily_reset_time)
 
-    def reset_daily_usage(self):
-        """每日重置使用次数"""
-        now = datetime.now()
-        reset_hour, reset_minute = map(int, self.daily_reset_time.split(":"))
-        reset_time = now.replace(hour=reset_hour, minute=reset_minute, second=0, microsecond=0)
+    @lazy_property
+    def transport(self) -> HttpTransport:
+        """所有对外请求共用一个带连接池的 HTTP 传输层"""
+        return HttpTransport(
+            pool_connections=int(self.conf.get("http_pool_connections", 8)),
+            pool_maxsize=int(self.conf.get("http_pool_maxsize", 16)),
+            timeouts=self.conf.get("http_timeouts", {}),
+            get_retries=int(self.conf.get("http_get_retries", 3)),
+            backoff_base=float(self.conf.get("http_backoff_base", 0.5)),
+        )
 
-        if now >= reset_time and self.last_reset_date < now.date():
-            self.user_usage.clear()  # 清空所有用户的使用记录
-            self.last_reset_date = now.date()
-            logger.info(f"[Siliconflow2cow] 已重置用户 dev 模型的使用次数")
-            
-    def schedule_next_run(self):
-        """安排下一次运行"""
-        self.timer = threading.Timer(self.clean_check_interval, self.run_clean_task)
-        self.timer.start()
+    @lazy_property
+    def source_images(self) -> SourceImageProcessor:
+        """图生图参考图：限制下载大小、按目标尺寸缩小，并按 URL 缓存编码结果"""
+        return SourceImageProcessor(
+            self.transport,
+            max_bytes=int(float(self.conf.get("source_image_max_mb", 10)) * 1024 * 1024),
+            cache_entries=int(self.conf.get("source_image_cache_entries", 32)),
+        )
+
+    @lazy_property
+    def prompt_cache(self) -> Optional[PromptCache]:
+        """提示词增强缓存，增强提示词变更后对应条目自动失效；未启用时为 None"""
+        if not self.conf.get("prompt_cache_enabled", True):
+            return None
+        prompt_cache = PromptCache(
+            os.path.join(self.data_dir, "prompt_cache.db"),
+            max_entries=int(self.conf.get("prompt_cache_max_entries", 5000)),
+            ttl=float(self.conf.get("prompt_cache_ttl", 7 * 86400)),
+        )
+        prompt_cache.retain_system_hashes([prompt_hash(self.enhancer_prompt), prompt_hash(self.enhancer_prompt_flux)])
+        return prompt_cache
 
-    def run_clean_task(self):
-        """运行清理任务并安排下一次运行"""
-        self.clean_old_images()
-        self.schedule_next_run()
+    @lazy_property
+    def image_store(self) -> ImageStore:
+        """按内容摘要保存图片（同时创建图片目录）"""
+        return ImageStore(self.image_output_dir, os.path.join(self.data_dir, "image_index.db"))
+
+    @lazy_property
+    def retention(self) -> RetentionManager:
+        """图片保留清单：按过期时间删除，可选总大小上限"""
+        return RetentionManager(
+            self.image_output_dir,
+            os.path.join(self.data_dir, "image_manifest.db"),
+            max_age=self.clean_interval * 86400,
+            max_bytes=int(float(self.conf.get("image_max_total_mb", 0)) * 1024 * 1024),
+            reconcile_interval=float(self.conf.get("image_manifest_reconcile_interval", 86400)),
+        )
+
+    def ensure_started(self):
+        """注册并启动周期任务，只执行一次"""
+        if self.started:
+            return
+        with self._start_lock:
+            if self.started or self.closed:
+                return
+            self.scheduler.add_job("cleanup", self.clean_check_interval, lambda: self.run_maintenance(self.clean_old_images))
+            self.scheduler.add_job("quota", float(self.conf.get("quota_purge_interval", 3600)), lambda: self.run_maintenance(self.quota.purge_stale))
+            if self.conf.get("prompt_cache_enabled", True):
+                self.scheduler.add_job("cache", float(self.conf.get("cache_purge_interval", 3600)), lambda: self.run_maintenance(self.prompt_cache.purge_expired))
+            if self.metrics_file:
+                self.scheduler.add_job("metrics", self.metrics_export_interval, self.run_metrics_export)
+            self.scheduler.start()
+            self.started = True
+
+    def run_metrics_export(self):
+        """导出指标文件"""
+        self.metrics.export(self.metrics_file)
+
+    def run_maintenance(self, task):
+        """执行共享数据的维护任务；多个进程共享数据时只有持有维护租约的进程执行"""
+        if self.shared_state.acquire_lease("maintenance", self.maintenance_lease_ttl):
+            task()
+        elif logger.isEnabledFor(logging.DEBUG):
+            logger.debug("[Siliconflow2cow] 维护租约由 %s 持有，跳过本次维护", self.shared_state.lease_owner('maintenance'))
+
+    def shutdown(self, timeout: float = None):
+        """停止周期任务，在 timeout 秒内等待进行中的绘图完成，然后关闭线程池、连接池和数据库"""
+        if self.closed:
+            return
+        self.closed = True
+        timeout = self.shutdown_timeout if timeout is None else timeout
+        logger.info("[Siliconflow2cow] 正在关闭插件")
+        self.handlers.clear()
+        self.scheduler.stop()
+
+        drained = True
+        if self.executor:
+            drained = self.executor.drain(timeout)
+            self.executor.shutdown(wait=False, cancel_futures=True)
+        self.io_pool.shutdown(wait=False, cancel_futures=True)
+        self.router.shutdown()
+        if self.delivery:
+            self.delivery.shutdown()
+        if is_created(self, "transport"):
+            self.transport.close()
+
+        if self.metrics_file:
+            try:
+                self.run_metrics_export()
+            except Exception as e:
+                logger.error(f"[Siliconflow2cow] 导出指标失败，错误：{e}")
+        if is_created(self, "shared_state"):
+            self.shared_state.release_lease("maintenance")
+        if not drained:
+            # 仍有任务在运行，数据库连接留给它们使用，随对象回收关闭
+            logger.warning(f"[Siliconflow2cow] 等待 {timeout:g} 秒后仍有绘图任务未完成，跳过关闭数据库")
+            return
+        for name in ("quota", "prompt_cache", "image_store", "retention", "shared_state"):
+            # 从未使用过的子系统没有创建，无需关闭
+            store = self.__dict__.get(name)
+            if store:
+                store.close()
+        logger.info("[Siliconflow2cow] 插件已关闭")
 
     def on_handle_context(self, e_context: EventContext):
-        if e_context["context"].type != ContextType.TEXT:
+        if self.closed or e_context["context"].type != ContextType.TEXT:
             return
-    
-        # 检查并重置使用次数
-        self.reset_daily_usage()
+        content = e_context["context"].content.strip()
+        # 与本插件无关的消息不启动周期任务，也不查询管理员身份
+        if not (content.startswith(COMMAND_PREFIXES) or content.lower() == "clean_all"
+                or content.startswith(tuple(self.drawing_prefixes))):
+            return
+        self.ensure_started()
     
         user_name = e_context["context"]["receiver"]
-        content = e_context["context"].content.strip()
     
         # 检查管理员身份
-        is_admin = user_name in self.admin_users
+        is_admin = self.shared_state.is_admin(user_name)
     
         # 处理设置管理员密码的命令（只有管理员可以执行）
         if content.startswith("$set_sf_admin_password "):
@@ -139,7 +385,7 @@ class Siliconflow2cow(Plugin):
                 new_password = args
                 self.admin_password = new_password
                 # 更新配置文件中的管理员密码
-                conf = super().load_config()
+                conf = self.load_config()
                 conf['admin_password'] = new_password
                 super().save_config(conf)
                 reply = Reply(ReplyType.TEXT, "管理员密码已更新。")
@@ -155,8 +401,7 @@ class Siliconflow2cow(Plugin):
             else:
                 provided_password = args
                 if provided_password == self.admin_password:
-                    self.admin_users.add(user_name)
-                    self.save_admin_users()
+                    self.shared_state.add_admin(user_name)
                     reply = Reply(ReplyType.TEXT, "管理员认证成功，您现在是管理员。")
                 else:
                     reply = Reply(ReplyType.TEXT, "管理员密码错误，认证失败。")
@@ -164,6 +409,52 @@ class Siliconflow2cow(Plugin):
             e_context.action = EventAction.BREAK_PASS
             return
     
+        # 查看 HTTP 连接池统计，只有管理员可以执行
+        if content == "$sf_http_stats":
+            if is_admin:
+                stats_text = "\n".join(filter(None, [self.transport.format_stats(), self.admission.format_stats(), self.router.format_stats(),
+                                                      self.fair.format_stats() if self.fair else ""]))
+                reply = Reply(ReplyType.TEXT, stats_text or "暂无请求记录。")
+            else:
+                reply = Reply(ReplyType.TEXT, "您没有权限执行此操作。")
+            e_context["reply"] = reply
+            e_context.action = EventAction.BREAK_PASS
+            return
+
+        # 查看缓存与请求合并统计，只有管理员可以执行
+        if content == "$sf_cache_stats":
+            if not is_admin:
+                reply = Reply(ReplyType.TEXT, "您没有权限执行此操作。")
+            else:
+                lines = []
+                if self.prompt_cache:
+                    stats = self.prompt_cache.stats()
+                    lines.append(f"提示词缓存：{stats['size']} 条，命中 {stats['hits']} 次，未命中 {stats['misses']} 次，命中率 {stats['hit_rate']:.1%}")
+                else:
+                    lines.append("提示词增强缓存未启用。")
+                flight = self.single_flight.stats()
+                lines.append(f"请求合并：实际执行 {flight['executed']} 次，合并节省 {flight['coalesced']} 次，进行中 {flight['in_flight']} 个")
+                lines.append(f"图片复用：{self.image_store.reused} 次")
+                source = self.source_images.stats()
+                lines.append(f"参考图缓存：{source['size']} 张，直接命中 {source['hits']} 次，校验后复用 {source['revalidated']} 次，下载 {source['misses']} 次")
+                reply = Reply(ReplyType.TEXT, "\n".join(lines))
+            e_context["reply"] = reply
+            e_context.action = EventAction.BREAK_PASS
+            return
+
+        # 查看各阶段耗时和计数器，只有管理员可以执行
+        if content == "$sf_stats":
+            if is_admin:
+                lines = self.metrics.summary()
+                for name, job in self.scheduler.stats().items():
+                    lines.append(f"周期任务 {name}: 执行 {job['runs']} 次，失败 {job['failures']} 次，{job['next_in']:.0f}s 后再次执行")
+                reply = Reply(ReplyType.TEXT, "\n".join(lines) or "暂无统计数据。")
+            else:
+                reply = Reply(ReplyType.TEXT, "您没有权限执行此操作。")
+            e_context["reply"] = reply
+            e_context.action = EventAction.BREAK_PASS
+            return
+
         # 处理 clean_all 命令，只有管理员可以执行
         if content.lower() == "clean_all":
             if is_admin:
@@ -177,7 +468,7 @@ class Siliconflow2cow(Plugin):
         if not content.startswith(tuple(self.drawing_prefixes)):
             return
     
-        logger.debug(f"[Siliconflow2cow] 收到消息: {content}")
+        logger.debug("[Siliconflow2cow] 收到消息: %s", content)
     
         try:
             # 移除前缀
@@ -186,44 +477,77 @@ class Siliconflow2cow(Plugin):
                     content = content[len(prefix):].strip()
                     break
     
-            model_key, image_size, clean_prompt = self.parse_user_input(content)
-            logger.debug(f"[Siliconflow2cow] 解析后的参数: 模型={model_key}, 尺寸={image_size}, 提示词={clean_prompt}")
+            self.model_registry.maybe_reload()
+            trace = RequestTrace(user=user_name, mode="async" if self.async_mode else "sync")
+            with request_trace.activate(trace), self.metrics.timer("parse"):
+                model_key, image_size, clean_prompt, image_count = self.parse_user_input(content)
+            trace.set(model=model_key, size=image_size, count=image_count, prompt_chars=len(clean_prompt))
+            logger.debug("[Siliconflow2cow] 解析后的参数: 模型=%s, 尺寸=%s, 提示词=%s, 数量=%s", model_key, image_size, clean_prompt, image_count)
     
-            # 如果不是管理员，检查使用限制
+            # 从接受命令起计算整个请求的时限，排队时间也计算在内
+            deadline = Deadline(self.stage_budgets(model_key)["total"])
+
+            # 如果不是管理员，检查并预扣使用额度，生成失败时退还
+            reservation = None
             if not is_admin:
-                # dev模型使用限制
-                if model_key == "dev":
-                    usage_count = self.user_usage.get(user_name, 0)
-                    if usage_count >= self.dev_model_usage_limit:
-                        reply = Reply(ReplyType.TEXT, f"您今天使用 dev 模型的次数已达上限 ({self.dev_model_usage_limit} 次)。")
-                        e_context["reply"] = reply
-                        e_context.action = EventAction.BREAK_PASS
-                        return
-    
-                    # 记录用户使用次数
-                    self.user_usage[user_name] = usage_count + 1
-    
-            # 生成图片
-            original_image_url = self.extract_image_url(clean_prompt)
-            logger.debug(f"[Siliconflow2cow] 原始提示词中提取的图片URL: {original_image_url}")
-    
-            enhanced_prompt = self.enhance_prompt(clean_prompt, model_key)
-            logger.debug(f"[Siliconflow2cow] 增强后的提示词: {enhanced_prompt}")
-    
-            image_url = self.generate_image(enhanced_prompt, original_image_url, model_key, image_size)
-            logger.debug(f"[Siliconflow2cow] 生成的图片URL: {image_url}")
-    
-            if image_url:
-                image_path = self.download_and_save_image(image_url)
-                logger.debug(f"[Siliconflow2cow] 图片已保存到: {image_path}")
-    
-                with open(image_path, 'rb') as f:
-                    image_storage = BytesIO(f.read())
-                reply = Reply(ReplyType.IMAGE, image_storage)
-            else:
-                logger.error("[Siliconflow2cow] 生成图片失败")
-                reply = Reply(ReplyType.ERROR, "生成图片失败。")
-    
+                try:
+                    reservation = self.quota.reserve(user_name, model_key, units=image_count)
+                except QuotaExceeded as e:
+                    self.metrics.inc("quota_rejections", {"model": model_key})
+                    reply = Reply(ReplyType.TEXT, str(e))
+                    e_context["reply"] = reply
+                    e_context.action = EventAction.BREAK_PASS
+                    return
+
+            # 在公平队列中登记，轮到时才开始生成
+            ticket = None
+            if self.fair:
+                group, member = self.tenant_of(e_context["context"])
+                try:
+                    ticket = self.fair.enqueue(group, member, self.fair_admin_weight if is_admin else 1, self.fair_cost(model_key, image_count))
+                except QueueLimitExceeded as e:
+                    self.quota.refund(reservation)
+                    self.metrics.inc("queue_rejections")
+                    e_context["reply"] = Reply(ReplyType.TEXT, str(e))
+                    e_context.action = EventAction.BREAK_PASS
+                    return
+            # 交给 execute_drawing 之后由它负责退还额度和释放排队名额
+            handed_off = False
+            try:
+                queue_notice = self.queue_notice(ticket)
+                if self.async_mode:
+                    channel = e_context["channel"]
+                    context = e_context["context"]
+                    trace.queued_at = time.perf_counter()
+                    job = (channel, context, model_key, image_size, clean_prompt, image_count, reservation, deadline, trace, ticket)
+                    if ticket:
+                        # 按公平顺序放行后才提交到线程池，先到的用户无法用排队任务占满线程池
+                        self.fair.when_granted(ticket, lambda _: self.start_granted_job(*job))
+                        handed_off = True
+                    else:
+                        handed_off = self.executor.try_submit(self.run_drawing_job, *job) is not None
+                    if not handed_off:
+                        self.metrics.inc("queue_rejections")
+                        reply = Reply(ReplyType.TEXT, "当前绘图任务较多，请稍后再试。")
+                    else:
+                        reply = Reply(ReplyType.TEXT, "\n".join(filter(None, [self.async_ack_message, queue_notice])))
+                else:
+                    if queue_notice:
+                        e_context["channel"].send(Reply(ReplyType.TEXT, queue_notice), e_context["context"])
+                    handed_off = True
+                    replies = self.execute_drawing(model_key, image_size, clean_prompt, image_count, reservation,
+                                                   e_context["channel"], e_context["context"], deadline, trace, ticket)
+                    # 多张图片时，前面的图片直接通过 channel 发送，最后一张作为本次回复
+                    for extra_reply in replies[:-1]:
+                        e_context["channel"].send(extra_reply, e_context["context"])
+                    reply = replies[-1]
+            finally:
+                if not handed_off:
+                    # 任务未被接受或提交前出错，退还刚预扣的额度并释放排队名额
+                    self.quota.refund(reservation)
+                    if ticket:
+                        self.fair.done(ticket)
+
             e_context["reply"] = reply
             e_context.action = EventAction.BREAK_PASS
     
@@ -236,177 +560,476 @@ class Siliconflow2cow(Plugin):
 
 
 
-    def parse_user_input(self, content: str) -> Tuple[str, str, str]:
+    def generate_reply(self, model_key: str, image_size: str, clean_prompt: str, image_count: int = 1, on_enhanced=None,
+                       deadline: Deadline = None) -> List[Reply]:
+        """生成图片并构造回复，并发的相同请求只调用一次接口；on_enhanced 在提示词增强完成后以增强后的提示词调用"""
+        original_image_url = self.extract_image_url(clean_prompt)
+        logger.debug("[Siliconflow2cow] 原始提示词中提取的图片URL: %s", original_image_url)
+
+        flight_key = (model_key, image_size, clean_prompt, original_image_url, image_count)
+        (image_paths, served_model), shared = self.single_flight.do(flight_key, self.produce_images, model_key, image_size, clean_prompt, original_image_url, image_count, on_enhanced, deadline)
+        trace = request_trace.current_trace()
+        if trace:
+            trace.set(served=served_model, coalesced=shared, images=len(image_paths))
+        if shared:
+            self.metrics.inc("cache_hits", {"cache": "coalesced"})
+            logger.debug("[Siliconflow2cow] 合并了相同的并发绘图请求: %s", flight_key)
+
+        if not image_paths:
+            logger.error("[Siliconflow2cow] 生成图片失败")
+            return [Reply(ReplyType.ERROR, "生成图片失败。")]
+        logger.debug("[Siliconflow2cow] 图片已保存到: %s", image_paths)
+
+        replies = []
+        if served_model != model_key:
+            # 主模型过慢或不可用时由其他模型生成，告知用户实际使用的模型
+            replies.append(Reply(ReplyType.TEXT, f"{model_key} 模型响应过慢或暂不可用，本次由 {served_model} 模型生成。"))
+
+        with self.metrics.timer("reply_build", model_key):
+            if len(image_paths) > 1 and self.batch_reply_mode == "grid":
+                replies.append(Reply(ReplyType.IMAGE, self.build_contact_sheet(image_paths)))
+                return replies
+
+            for image_path in image_paths:
+                # 按配置压缩后发送，原图仍保留在图片目录中
+                encoded = None
+                if self.delivery:
+                    with self.metrics.timer("encode", model_key):
+                        encoded = self.delivery.encode(image_path)
+                # 不压缩时直接用文件对象作为回复内容，不再把整张图片读入内存
+                replies.append(Reply(ReplyType.IMAGE, encoded or open(image_path, 'rb')))
+            return replies
+
+    def produce_images(self, model_key: str, image_size: str, clean_prompt: str, original_image_url: str, image_count: int = 1, on_enhanced=None,
+                       deadline: Deadline = None) -> Tuple[List[str], str]:
+        """执行增强、生成、下载的完整流程，返回保存的图片路径列表和实际使用的模型"""
+        with self.metrics.timer("enhance", model_key):
+            enhanced_prompt = self.enhance_prompt(clean_prompt, model_key, deadline)
+        logger.debug("[Siliconflow2cow] 增强后的提示词: %s", enhanced_prompt)
+
+        request_key = self.image_store.request_key(model_key, image_size, enhanced_prompt, {"source_image": original_image_url})
+        # 多张图片分别以 request_key#序号 建立索引
+        request_keys = [request_key] + [f"{request_key}#{i}" for i in range(1, image_count)]
+        if self.reuse_identical_results:
+            image_paths = [self.image_store.lookup(key) for key in request_keys]
+            if all(image_paths):
+                self.metrics.inc("cache_hits", {"cache": "image"})
+                trace = request_trace.current_trace()
+                if trace:
+                    trace.set(reused=True)
+                for image_path in image_paths:
+                    self.retention.touch(image_path)
+                return image_paths, model_key
+
+        if on_enhanced:
+            on_enhanced(enhanced_prompt)
+        with self.metrics.timer("generate", model_key):
+            image_urls, served_model = self.generate_image(enhanced_prompt, original_image_url, model_key, image_size, image_count, deadline)
+        logger.debug("[Siliconflow2cow] 生成的图片URL: %s", image_urls)
+        if not image_urls:
+            return [], served_model
+        if served_model != model_key:
+            # 其他模型生成的结果不作为该请求的复用结果
+            request_keys = [None] * len(image_urls)
+
+        # 并行下载多张图片
+        download = request_trace.bind(self.download_and_save_image)
+        futures = [self.io_pool.submit(download, url, key, model_key, deadline) for url, key in zip(image_urls, request_keys)]
+        return [future.result() for future in futures], served_model
+
+    def build_contact_sheet(self, image_paths: List[str]) -> BytesIO:
+        """把多张图片拼成一张网格图"""
+        from PIL import Image
+
+        images = [Image.open(path) for path in image_paths]
+        columns = math.ceil(math.sqrt(len(images)))
+        rows = math.ceil(len(images) / columns)
+        cell = self.contact_sheet_cell_size
+        sheet = Image.new("RGB", (columns * cell, rows * cell), "white")
+        for index, image in enumerate(images):
+            image.thumbnail((cell, cell))
+            x = (index % columns) * cell + (cell - image.width) // 2
+            y = (index // columns) * cell + (cell - image.height) // 2
+            sheet.paste(image.convert("RGB"), (x, y))
+            image.close()
+        buffer = BytesIO()
+        sheet.save(buffer, format="JPEG", quality=90)
+        buffer.seek(0)
+        return buffer
+
+    def execute_drawing(self, model_key: str, image_size: str, clean_prompt: str, image_count: int = 1, reservation=None,
+                        channel=None, context=None, deadline: Deadline = None, trace: RequestTrace = None, ticket: Ticket = None) -> List[Reply]:
+        """生成图片并在失败时退还预扣的额度；提供 channel 时按配置先发送预览图，超出时限时回复超时提示"""
+        if trace is None:
+            trace = RequestTrace(model=model_key, size=image_size, count=image_count)
+        if trace.queued_at is not None:
+            trace.add_stage("queue", time.perf_counter() - trace.queued_at)
+        try:
+            with request_trace.activate(trace):
+                replies, outcome = self._execute_drawing(model_key, image_size, clean_prompt, image_count, reservation, channel, context, deadline, ticket)
+        finally:
+            if ticket:
+                self.fair.done(ticket)
+        self.tracer.finish(trace, outcome)
+        return replies
+
+    def _execute_drawing(self, model_key: str, image_size: str, clean_prompt: str, image_count: int, reservation,
+                         channel, context, deadline: Deadline, ticket: Ticket = None) -> Tuple[List[Reply], str]:
+        if self.memory_profiling:
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        if deadline is None:
+            deadline = Deadline(self.stage_budgets(model_key)["total"])
+        outcome = "ok"
+        tracker = FirstImageTracker()
+        on_enhanced = None
+        if channel is not None and self.should_preview(model_key, clean_prompt):
+            on_enhanced = lambda prompt: self.io_pool.submit(self.send_preview, tracker, channel, context, model_key, image_size, prompt, deadline)
+        try:
+            deadline.check("排队")
+            self.wait_for_turn(ticket, deadline)
+            replies = self.generate_reply(model_key, image_size, clean_prompt, image_count, on_enhanced, deadline)
+        except DeadlineExceeded as e:
+            logger.warning(f"[Siliconflow2cow] 绘图请求超时: {e}")
+            outcome = "timeout"
+            replies = [Reply(ReplyType.ERROR, str(e))]
+        except Exception as e:
+            logger.error(f"[Siliconflow2cow] 发生错误: {e}")
+            replies = [Reply(ReplyType.ERROR, f"发生错误: {str(e)}")]
+        succeeded = any(reply.type == ReplyType.IMAGE for reply in replies)
+        if not succeeded and outcome == "ok":
+            outcome = "error"
+        elapsed = time.perf_counter() - start
+        self.metrics.observe("total", model_key, outcome, elapsed)
+        if succeeded:
+            # 按提示词处理方式（llm/passthrough/normalize/cached 等）区分端到端耗时，对比跳过增强的效果
+            trace = request_trace.current_trace()
+            self.metrics.observe("e2e_by_enhance", model_key, trace.fields.get("enhance", "shared") if trace else "-", elapsed)
+            first_image_seconds, first_kind = tracker.finish()
+            self.metrics.observe("first_image", model_key, first_kind, first_image_seconds)
+        else:
+            tracker.finish()
+        if not succeeded:
+            self.quota.refund(reservation)
+        if self.memory_profiling:
+            # 并发请求时峰值会互相叠加，适合单请求压测时对比
+            logger.info(f"[Siliconflow2cow] 本次绘图 Python 内存峰值: {tracemalloc.get_traced_memory()[1] / 1024 / 1024:.1f} MB")
+        return replies, outcome
+
+    def config_source(self) -> Tuple[Optional[str], Optional[str]]:
+        """返回宿主实际读取的配置文件和其中本插件的段名
+
+        与宿主的 load_config 一致：plugins/config.json 中有本插件的配置时优先使用（段名不区分大小写），
+        否则使用插件目录下的 config.json（整个文件就是本插件的配置，段名为 None）。
+        """
+        global_path = os.path.abspath(os.path.join("plugins", "config.json"))
+        try:
+            with open(global_path, encoding="utf-8") as f:
+                sections = json.load(f) or {}
+            for key in sections:
+                if key.lower() == self.name.lower():
+                    return global_path, key
+        except (OSError, ValueError):
+            pass
+        if getattr(self, "path", None):
+            return os.path.join(self.path, "config.json"), None
+        return None, None
+
+    def tenant_of(self, context) -> Tuple[str, str]:
+        """返回 (群组, 用户)；私聊时群组就是用户本身"""
+        receiver = context["receiver"]
+        if not context.get("isgroup"):
+            return receiver, receiver
+        msg = context.get("msg")
+        return receiver, getattr(msg, "actual_user_id", None) or receiver
+
+    def fair_cost(self, model_key: str, image_count: int) -> float:
+        """公平调度中一次请求的成本：按 fair_model_costs 配置，未配置时快速模型为1、其他模型为2，乘以图片张数"""
+        default = 1 if self.model_registry.is_turbo(model_key) else 2
+        return float(self.fair_model_costs.get(model_key, default)) * image_count
+
+    def queue_notice(self, ticket: Ticket) -> str:
+        """需要排队时告知用户排队位置和预计等待时间"""
+        if ticket is None or ticket.granted.is_set():
+            return ""
+        ahead, eta = self.fair.position(ticket)
+        notice = f"当前绘图任务较多，前面还有 {ahead} 个任务" if ahead else "当前绘图任务较多，正在排队"
+        if eta >= 1:
+            notice += f"，预计等待约 {math.ceil(eta)} 秒"
+        return notice + "。"
+
+    def wait_for_turn(self, ticket: Ticket, deadline: Deadline):
+        """在公平队列中等待放行，超出时限时抛出 DeadlineExceeded"""
+        if ticket is None or ticket.granted.is_set():
+            return
+        start = time.perf_counter()
+        try:
+            while not self.fair.wait(ticket, deadline.wait_timeout()):
+                deadline.check("排队")
+        finally:
+            request_trace.record_stage("queue_wait", time.perf_counter() - start)
+
+    def should_preview(self, model_key: str, clean_prompt: str) -> bool:
+        """只为慢模型的文生图生成预览，快速模型本身就能很快出图"""
+        return (
+            self.progressive_preview
+            and not self.model_registry.is_turbo(model_key)
+            and model_key != self.preview_model
+            and not self.extract_image_url(clean_prompt)
+        )
+
+    def send_preview(self, tracker: FirstImageTracker, channel, context, model_key: str, image_size: str, prompt: str,
+                     deadline: Deadline = None):
+        """用快速模型生成小尺寸预览图并发送，最终图片已完成时放弃发送；预览失败不影响最终结果"""
+        try:
+            with self.metrics.timer("preview", self.preview_model):
+                image_urls = self.generate_image_by_text(prompt, self.preview_model, preview_size(image_size, self.preview_max_side), deadline=deadline)
+                if not image_urls or tracker.finished:
+                    return
+                image_path = self.download_and_save_image(image_urls[0], model_key=self.preview_model, deadline=deadline)
+            if not tracker.claim_preview():
+                self.metrics.inc("previews", {"model": model_key, "result": "late"})
+                return
+            channel.send(Reply(ReplyType.TEXT, f"预览图（{self.preview_model} 快速生成），{model_key} 高清图片生成中..."), context)
+            channel.send(Reply(ReplyType.IMAGE, open(image_path, 'rb')), context)
+            self.metrics.inc("previews", {"model": model_key, "result": "sent"})
+        except Exception as e:
+            self.metrics.inc("previews", {"model": model_key, "result": "error"})
+            logger.warning(f"[Siliconflow2cow] 生成预览图失败: {e}")
+
+    def start_granted_job(self, channel, context, model_key: str, image_size: str, clean_prompt: str, image_count: int, reservation,
+                          deadline: Deadline, trace: RequestTrace, ticket: Ticket):
+        """公平队列放行后提交异步绘图任务；插件已关闭或线程池已满时退还额度并释放排队名额"""
+        future = None
+        if not self.closed:
+            try:
+                future = self.executor.try_submit(self.run_drawing_job, channel, context, model_key, image_size, clean_prompt, image_count,
+                                                  reservation, deadline, trace, ticket)
+            except RuntimeError as e:
+                # 线程池已在关闭
+                logger.warning(f"[Siliconflow2cow] 提交绘图任务失败: {e}")
+        if future is not None:
+            return
+        self.quota.refund(reservation)
+        self.fair.done(ticket)
+        if self.closed:
+            return
+        self.metrics.inc("queue_rejections")
+        try:
+            channel.send(Reply(ReplyType.TEXT, "当前绘图任务较多，请稍后再试。"), context)
+        except Exception as e:
+            logger.error(f"[Siliconflow2cow] 发送排队失败提示失败: {e}")
+
+    def run_drawing_job(self, channel, context, model_key: str, image_size: str, clean_prompt: str, image_count: int = 1, reservation=None,
+                        deadline: Deadline = None, trace: RequestTrace = None, ticket: Ticket = None):
+        """在工作线程中生成图片，完成后通过 channel 发送给用户"""
+        replies = self.execute_drawing(model_key, image_size, clean_prompt, image_count, reservation, channel, context, deadline, trace, ticket)
+        try:
+            for reply in replies:
+                channel.send(reply, context)
+        except Exception as e:
+            logger.error(f"[Siliconflow2cow] 发送异步绘图结果失败: {e}")
+
+    def stage_budgets(self, model_key: str) -> dict:
+        """合并默认预算、deadlines.default 和该模型的预算"""
+        budgets = dict(DEFAULT_BUDGETS)
+        budgets.update(self.deadline_budgets.get("default", {}))
+        budgets.update(self.deadline_budgets.get(model_key, {}))
+        if budgets["total"] > 0 and budgets["download"] >= budgets["total"]:
+            # 下载预留占满总时限时，生成阶段一开始就已超时
+            if model_key not in self.invalid_budget_models:
+                self.invalid_budget_models.add(model_key)
+                logger.warning(f"[Siliconflow2cow] 模型 {model_key} 的 download 预算（{budgets['download']:g}s）不小于 total（{budgets['total']:g}s），改为 total 的四分之一")
+            budgets["download"] = budgets["total"] / 4
+        return budgets
+
+    def parse_user_input(self, content: str) -> Tuple[str, str, str, int]:
         model_key = self.extract_model_key(content)
         image_size = self.extract_image_size(content, model_key)  # 传入 model_key
+        image_count = self.extract_image_count(content)
         clean_prompt = self.clean_prompt_string(content, model_key)
-        logger.debug(f"[Siliconflow2cow] 解析用户输入: 模型={model_key}, 尺寸={image_size}, 清理后的提示词={clean_prompt}")
-        return model_key, image_size, clean_prompt
+        logger.debug("[Siliconflow2cow] 解析用户输入: 模型=%s, 尺寸=%s, 数量=%s, 清理后的提示词=%s", model_key, image_size, image_count, clean_prompt)
+        return model_key, image_size, clean_prompt, image_count
 
 
-    def enhance_prompt(self, prompt: str, model_key: str) -> str:
-        """根据模型选择合适的提示词增强策略，同时进行翻译"""
+    def enhance_prompt(self, prompt: str, model_key: str, deadline: Deadline = None) -> str:
+        """根据模型选择合适的提示词增强策略，同时进行翻译；超时或失败时使用原始提示词"""
         # 将提示词在强化过程中翻译
-        logger.debug(f"[Siliconflow2cow] 使用的模型名称：{self.chat_model}")
-        logger.debug(f"[Siliconflow2cow] 正在处理提示词: {prompt}")
+        logger.debug("[Siliconflow2cow] 使用的模型名称：%s", self.chat_model)
+        logger.debug("[Siliconflow2cow] 正在处理提示词: %s", prompt)
 
-    
         # 根据模型选择使用的增强策略
-        if model_key in ["dev", "flux"]:
-            try:
-                logger.debug(f"[Siliconflow2cow] 模型 {model_key} 使用 ENHANCER_PROMPT_FLUX 进行提示词增强。")
-    
-                request_data = {
-                    "model": self.chat_model,
-                    "messages": [
-                        {"role": "system", "content": self.enhancer_prompt_flux},
-                        {"role": "user", "content": prompt}
-                    ]
-                }
-                logger.debug(f"[Siliconflow2cow] 提示词增强请求体: {json.dumps(request_data, ensure_ascii=False)}")
-    
-                response = requests.post(
-                    self.chat_api_url,
-                    headers={
-                        "Content-Type": "application/json; charset=utf-8",
-                        "Authorization": f"Bearer {self.auth_token}"
-                    },
-                    json=request_data
-                )
-                response.raise_for_status()
-                enhanced_prompt = response.json()['choices'][0]['message']['content']
-                logger.debug(f"[Siliconflow2cow] 提示词增强完成: {enhanced_prompt}")
-                return enhanced_prompt
-            except requests.exceptions.HTTPError as e:
-                if e.response is not None:
-                    logger.error(f"[Siliconflow2cow] 提示词增强失败，状态码: {e.response.status_code}，响应内容: {e.response.text}")
-                else:
-                    logger.error(f"[Siliconflow2cow] 提示词增强失败: {e}")
-                return prompt  # 如果增强失败，返回原始提示词
+        enhancer = self.model_registry.enhancer_for(model_key)
+        if enhancer == "none":
+            logger.debug("[Siliconflow2cow] 模型 %s 不需要提示词增强", model_key)
+            self.mark_enhance_path("none")
+            return prompt
+
+        # 已经足够详细的英文提示词直接使用，简短的英文提示词只做本地整理
+        thresholds = self.classifier_thresholds(model_key)
+        decision, features = classify_prompt(prompt, thresholds)
+        if decision != ENHANCE:
+            self.metrics.inc("enhance_avoided", {"model": model_key, "decision": decision})
+            self.mark_enhance_path(decision)
+            logger.debug("[Siliconflow2cow] 提示词无需增强（%s）: %s", decision, features)
+            return prompt if decision == PASSTHROUGH else normalize_prompt(prompt, thresholds["normalize_suffix"])
+        if enhancer == "flux":
+            logger.debug("[Siliconflow2cow] 模型 %s 使用 ENHANCER_PROMPT_FLUX 进行提示词增强。", model_key)
+            system_prompt = self.enhancer_prompt_flux
         else:
-            # 使用默认的 ENHANCER_PROMPT 进行提示词增强
-            try:
-                logger.debug(f"[Siliconflow2cow] 正在使用 ENHANCER_PROMPT 进行提示词增强: {prompt}")
-    
-                request_data = {
-                    "model": self.chat_model,
-                    "messages": [
-                        {"role": "system", "content": self.enhancer_prompt},
-                        {"role": "user", "content": prompt}
-                    ]
-                }
-                logger.debug(f"[Siliconflow2cow] 提示词增强请求体: {json.dumps(request_data, ensure_ascii=False)}")
-    
-                response = requests.post(
-                    self.chat_api_url,
-                    headers={
-                        "Content-Type": "application/json; charset=utf-8",
-                        "Authorization": f"Bearer {self.auth_token}"
-                    },
-                    json=request_data
-                )
-                response.raise_for_status()
-                enhanced_prompt = response.json()['choices'][0]['message']['content']
-                logger.debug(f"[Siliconflow2cow] 提示词增强完成: {enhanced_prompt}")
-                return enhanced_prompt
-            except requests.exceptions.HTTPError as e:
-                if e.response is not None:
-                    logger.error(f"[Siliconflow2cow] 提示词增强失败，状态码: {e.response.status_code}，响应内容: {e.response.text}")
-                else:
-                    logger.error(f"[Siliconflow2cow] 提示词增强失败: {e}")
-                return prompt  # 如果增强失败，返回原始提示词
+            logger.debug("[Siliconflow2cow] 正在使用 ENHANCER_PROMPT 进行提示词增强: %s", prompt)
+            system_prompt = self.enhancer_prompt
 
+        system_hash = prompt_hash(system_prompt)
+        if self.prompt_cache:
+            cached = self.prompt_cache.get(self.chat_model, system_hash, prompt)
+            if cached is not None:
+                self.metrics.inc("cache_hits", {"cache": "prompt"})
+                self.mark_enhance_path("cached")
+                logger.debug("[Siliconflow2cow] 命中提示词增强缓存: %s", cached)
+                return cached
 
+        # 增强最多占用 enhance 预算，剩余时间留给生成和下载
+        enhance_deadline = deadline.slice(self.stage_budgets(model_key)["enhance"]) if deadline else None
+        try:
+            if self.enhance_batcher:
+                enhanced_prompt = self.enhance_batcher.enhance(system_prompt, prompt, enhance_deadline)
+            else:
+                enhanced_prompt = self.request_enhancement(system_prompt, prompt, enhance_deadline)
+            logger.debug("[Siliconflow2cow] 提示词增强完成: %s", enhanced_prompt)
+        except (requests.exceptions.Timeout, DeadlineExceeded) as e:
+            self.mark_enhance_path("fallback")
+            self.metrics.inc("enhance_fallbacks", {"model": model_key, "reason": "timeout"})
+            logger.warning(f"[Siliconflow2cow] 提示词增强超时，使用原始提示词: {e}")
+            return prompt
+        except requests.exceptions.HTTPError as e:
+            self.mark_enhance_path("fallback")
+            self.metrics.inc("enhance_fallbacks", {"model": model_key, "reason": "error"})
+            if e.response is not None:
+                logger.error(f"[Siliconflow2cow] 提示词增强失败，状态码: {e.response.status_code}，响应内容: {e.response.text}")
+            else:
+                logger.error(f"[Siliconflow2cow] 提示词增强失败: {e}")
+            return prompt  # 如果增强失败，返回原始提示词
+        except (requests.exceptions.RequestException, KeyError, IndexError, ValueError) as e:
+            # 连接错误或响应格式异常
+            self.mark_enhance_path("fallback")
+            self.metrics.inc("enhance_fallbacks", {"model": model_key, "reason": "error"})
+            logger.error(f"[Siliconflow2cow] 提示词增强失败: {e}")
+            return prompt
 
+        self.mark_enhance_path("llm")
+        if self.prompt_cache:
+            self.prompt_cache.put(self.chat_model, system_hash, prompt, enhanced_prompt)
+        return enhanced_prompt
 
+    def classifier_thresholds(self, model_key: str) -> dict:
+        """合并默认阈值、fast_path.default 和该模型的阈值"""
+        thresholds = dict(DEFAULT_THRESHOLDS)
+        thresholds.update(self.fast_path_thresholds.get("default", {}))
+        thresholds.update(self.fast_path_thresholds.get(model_key, {}))
+        return thresholds
+
+    def mark_enhance_path(self, path: str):
+        """记录本次请求的提示词处理方式，用于按处理方式统计端到端耗时"""
+        trace = request_trace.current_trace()
+        if trace:
+            trace.set(enhance=path)
+
+    def request_enhancement(self, system_prompt: str, prompt: str, deadline: Deadline = None) -> str:
+        """调用对话接口增强单条提示词"""
+        self.metrics.inc("enhance_requests", {"mode": "single"})
+        return self.post_chat([
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": prompt}
+        ], deadline)
+
+    def request_batch_enhancement(self, system_prompt: str, prompts: List[str], deadline: Deadline = None) -> List[str]:
+        """一次请求增强多条提示词，输出无法解析为等长的 JSON 数组时返回 None"""
+        self.metrics.inc("enhance_requests", {"mode": "batch"})
+        content = self.post_chat(build_batch_messages(system_prompt, prompts), deadline)
+        results = parse_batch_output(content, len(prompts))
+        if results is None:
+            logger.warning(f"[Siliconflow2cow] 批量提示词增强的输出无法解析: {content}")
+        return results
+
+    def post_chat(self, messages: List[dict], deadline: Deadline = None) -> str:
+        request_data = {
+            "model": self.chat_model,
+            "messages": messages
+        }
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("[Siliconflow2cow] 提示词增强请求体: %s", json.dumps(request_data, ensure_ascii=False))
 
-    def generate_image(self, prompt: str, original_image_url: str, model_key: str, image_size: str) -> str:
+        response = self.transport.post(
+            "chat",
+            self.chat_api_url,
+            headers={
+                "Content-Type": "application/json; charset=utf-8",
+                "Authorization": f"Bearer {self.auth_token}"
+            },
+            json=request_data,
+            **self.timeout_kwargs("chat", deadline, "提示词增强")
+        )
+        response.raise_for_status()
+        return response.json()['choices'][0]['message']['content']
+
+    def generate_image(self, prompt: str, original_image_url: str, model_key: str, image_size: str, image_count: int = 1,
+                       deadline: Deadline = None) -> Tuple[List[str], str]:
+        """生成 image_count 张图片，返回图片 URL 和实际使用的模型；模型单次最多生成 max_batch 张，超出部分拆成多次并行请求"""
+        # 生成阶段需要为下载保留时间
+        if deadline:
+            deadline = deadline.reserve(self.stage_budgets(model_key)["download"])
         if original_image_url:
-            logger.debug(f"[Siliconflow2cow] 检测到图片URL，使用图生图模式")
-            return self.generate_image_by_img(prompt, original_image_url, model_key, image_size)
+            logger.debug("[Siliconflow2cow] 检测到图片URL，使用图生图模式")
+            generate = lambda batch: (model_key, self.generate_image_by_img(prompt, original_image_url, model_key, image_size, batch, deadline))
+        else:
+            logger.debug("[Siliconflow2cow] 未检测到图片URL，使用文生图模式")
+            # 文生图按 routing 配置对冲或切换到备用模型
+            generate = lambda batch: self.router.run(model_key, lambda key: self.generate_image_by_text(prompt, key, image_size, batch, deadline), deadline)
+
+        max_batch = self.model_registry.max_batch_for(model_key, bool(original_image_url))
+        batches = [min(max_batch, image_count - start) for start in range(0, image_count, max_batch)]
+        if len(batches) == 1:
+            results = [generate(batches[0])]
         else:
-            logger.debug(f"[Siliconflow2cow] 未检测到图片URL，使用文生图模式")
-            return self.generate_image_by_text(prompt, model_key, image_size)
+            generate = request_trace.bind(generate)
+            futures = [self.io_pool.submit(generate, batch) for batch in batches]
+            results = [future.result() for future in futures]
+        served_models = list(dict.fromkeys(served for served, _ in results))
+        served_model = model_key if served_models == [model_key] else "/".join(served_models)
+        return [url for _, urls in results for url in urls][:image_count], served_model
 
-    def generate_image_by_text(self, prompt: str, model_key: str, image_size: str) -> str:
-        url = self.get_url_for_model(model_key)
-        logger.debug(f"[Siliconflow2cow] 使用模型URL: {url}")
+    def generate_image_by_text(self, prompt: str, model_key: str, image_size: str, batch_size: int = 1, deadline: Deadline = None) -> List[str]:
+        url, template = self.model_registry.text_request(model_key)
+        logger.debug("[Siliconflow2cow] 使用模型URL: %s", url)
 
         width, height = map(int, image_size.split('x'))
 
         json_body = {
+            **template,
             "prompt": prompt,
             "width": width,
             "height": height
         }
+        if batch_size > 1:
+            json_body["batch_size"] = batch_size
 
         headers = {
             'Authorization': f"Bearer {self.auth_token}",
             'Accept': 'application/json',
             'Content-Type': 'application/json'
         }
-        
-        # 只有 fluxdev 需要单独传递 model 字段
-        if model_key == "dev":
-            json_body["model"] = "black-forest-labs/FLUX.1-dev"
-            json_body.update({
-                "num_inference_steps": 30,
-                "guidance_scale": 3.5
-            })
-
-        elif model_key == "schnell":        
-            json_body.update({
-                "num_inference_steps": 20,
-                "guidance_scale": 3.5
-            })
-        elif model_key == "sd2":
-            json_body.update({
-                "num_inference_steps": 25,
-                "guidance_scale": 6.0
-            })
-        elif model_key == "sd35": 
-            json_body["model"] = "stabilityai/stable-diffusion-3-5-large"
-            json_body.update({
-                "num_inference_steps": 30,
-                "guidance_scale": 4.5
-            })
-        elif model_key == "sd3":
-            json_body.update({
-                "num_inference_steps": 30,
-                "guidance_scale": 4.5
-            })
-        elif model_key == "sdt":
-            json_body.update({
-                "num_inference_steps": 6,
-                "guidance_scale": 1.0,
-                "cfg_scale": 1.0
-            })
-        elif model_key == "sdxlt":
-            json_body.update({
-                "num_inference_steps": 4,
-                "guidance_scale": 1.0
-            })
-        elif model_key == "sdxll":
-            json_body.update({
-                "num_inference_steps": 4,
-                "guidance_scale": 1.0
-            })
-        else:
-            json_body.update({
-                "num_inference_steps": 25,
-                "guidance_scale": 3.5
-            })
 
-
-
-        logger.debug(f"[Siliconflow2cow] 发送请求体: {json_body}")
+        logger.debug("[Siliconflow2cow] 发送请求体: %s", json_body)
         try:
-            response = requests.post(url, headers=headers, json=json_body)
+            response = self.post_generate(url, headers, json_body, deadline)
             response.raise_for_status()
             json_response = response.json()
-            logger.debug(f"[Siliconflow2cow] API响应: {json_response}")
-            return json_response['images'][0]['url']
+            logger.debug("[Siliconflow2cow] API响应: %s", json_response)
+            return [image['url'] for image in json_response['images']]
         except requests.exceptions.RequestException as e:
+            if deadline:
+                deadline.check("图片生成")
             if e.response is not None:
                 logger.error(f"[Siliconflow2cow] API请求失败，响应内容: {e.response.text}")
             logger.error(f"[Siliconflow2cow] API请求失败: {e}")
@@ -418,52 +1041,27 @@ class Siliconflow2cow(Plugin):
                 logger.error(f"[Siliconflow2cow] API响应内容: {e.response.text}")
             raise Exception(f"API请求失败: {str(e)}")
         
-            logger.debug(f"[Siliconflow2cow] 发送请求体: {json_body}")
+            logger.debug("[Siliconflow2cow] 发送请求体: %s", json_body)
             
 
-    def generate_image_by_img(self, prompt: str, image_url: str, model_key: str, image_size: str) -> str:
-        url = self.get_img_url_for_model(model_key)
-        logger.debug(f"[Siliconflow2cow] 使用图生图模型URL: {url}")
+    def generate_image_by_img(self, prompt: str, image_url: str, model_key: str, image_size: str, batch_size: int = 1, deadline: Deadline = None) -> List[str]:
+        url, template = self.model_registry.img_request(model_key)
+        logger.debug("[Siliconflow2cow] 使用图生图模型URL: %s", url)
         img_prompt = self.remove_image_urls(prompt)
 
-        base64_image = self.convert_image_to_base64(image_url)
-
         width, height = map(int, image_size.split('x'))
 
+        with self.metrics.timer("source_fetch", model_key):
+            base64_image = self.convert_image_to_base64(image_url, width, height, deadline)
+
         json_body = {
+            **template,
             "prompt": img_prompt,
             "image": base64_image,
             "width": width,
             "height": height,
-            "batch_size": 1
+            "batch_size": batch_size
         }
-        
-        if model_key == "sdxl":
-            json_body.update({
-                "num_inference_steps": 30,
-                "guidance_scale": 7.0
-            })
-        elif model_key == "sd2":
-            json_body.update({
-                "num_inference_steps": 30,
-                "guidance_scale": 7.0
-            })
-        elif model_key == "sdxll":
-            json_body.update({
-                "num_inference_steps": 4,
-                "guidance_scale": 1.0
-            })
-        elif model_key == "pm":
-            json_body.update({
-                "style_name": "Photographic (Default)",
-                "guidance_scale": 5,
-                "style_strengh_radio": 20
-            })
-        else:
-            json_body.update({
-                "num_inference_steps": 30,
-                "guidance_scale": 7.5
-            })
 
         headers = {
             'Authorization': f"Bearer {self.auth_token}",
@@ -471,17 +1069,19 @@ class Siliconflow2cow(Plugin):
             'Content-Type': 'application/json'
         }
 
-        log_json_body = json_body.copy()
-        log_json_body['image'] = '[BASE64_IMAGE_DATA]'
-        logger.debug(f"[Siliconflow2cow] 发送图生图请求体: {log_json_body}")
+        if logger.isEnabledFor(logging.DEBUG):
+            # 只在需要输出时才复制请求体并隐去图片数据
+            logger.debug("[Siliconflow2cow] 发送图生图请求体: %s", {**json_body, "image": "[BASE64_IMAGE_DATA]"})
 
         try:
-            response = requests.post(url, headers=headers, json=json_body)
+            response = self.post_generate(url, headers, json_body, deadline)
             response.raise_for_status()
             json_response = response.json()
-            logger.debug(f"[Siliconflow2cow] API响应: {json_response}")
-            return json_response['images'][0]['url']
+            logger.debug("[Siliconflow2cow] API响应: %s", json_response)
+            return [image['url'] for image in json_response['images']]
         except requests.exceptions.RequestException as e:
+            if deadline:
+                deadline.check("图片生成")
             logger.error(f"[Siliconflow2cow] API请求失败: {e}")
             if hasattr(e, 'response') and e.response is not None:
                 if e.response.status_code == 400:
@@ -490,163 +1090,142 @@ class Siliconflow2cow(Plugin):
                 logger.error(f"[Siliconflow2cow] API响应内容: {e.response.text}")
             raise Exception(f"API请求失败: {str(e)}")
 
+    def post_generate(self, url: str, headers: dict, json_body: dict, deadline: Deadline = None) -> requests.Response:
+        """在接口并发名额内发送生成请求；时限不足时抛出 DeadlineExceeded，而不是排队后报告接口繁忙"""
+        if deadline:
+            deadline.check("图片生成")
+        try:
+            return self.admission.send(
+                url,
+                lambda: self.transport.post("generate", url, headers=headers, json=json_body, **self.timeout_kwargs("generate", deadline, "图片生成")),
+                max_wait=deadline.remaining() if deadline else None,
+                deadline=deadline,
+            )
+        except UpstreamBusy:
+            if deadline:
+                deadline.check("图片生成")
+            raise
+
     def extract_model_key(self, prompt: str) -> str:
         match = re.search(r'--m ?(\S+)', prompt)
         model_key = match.group(1).strip() if match else self.default_drawing_model  # 使用配置中的 default_drawing_model
-        logger.debug(f"[Siliconflow2cow] 提取的模型键: {model_key}")
+        logger.debug("[Siliconflow2cow] 提取的模型键: %s", model_key)
         return model_key
 
     def extract_image_size(self, prompt: str, model_key: str) -> str:
-        # 定义支持的尺寸映射关系
-        ratio_map_common = {
-            "1:1": "1024x1024",
-            "9:16": "1152x2048",
-            "16:9": "2048x1152",
-            "3:2": "1536x1024",
-            "2:3": "1024x2048",
-            "4:3": "1536x2048",
-        }
-
-        ratio_map_special = {
-            "1:1": "1024x1024",
-            "9:16": "576x1024",
-            "16:9": "1024x576",
-            "3:2": "768x512",
-            "2:3": "512x1024",
-            "4:3": "768x1024",
-        }
-
-        # 根据模型选择对应的尺寸映射
-        if model_key in ["sd35", "FLUX.1-schnell", "Pro-FLUX.1-schnell", "FLUX.1-dev"]:
-            ratio_map = ratio_map_special
-        else:
-            ratio_map = ratio_map_common
-
         match = re.search(r'--ar (\d+:\d+)', prompt)
         if match:
             ratio = match.group(1).strip()
-            # 根据映射选择适当的尺寸
-            size = ratio_map.get(ratio, "1024x1024")  # 默认使用 1024x1024
+            # 根据模型对应的尺寸表选择适当的尺寸，默认使用 1024x1024
+            size = self.model_registry.size_for(model_key, ratio)
         else:
             size = "1024x1024"
 
-        logger.debug(f"[Siliconflow2cow] 提取的图片尺寸: {size}")
+        logger.debug("[Siliconflow2cow] 提取的图片尺寸: %s", size)
         return size
 
 
+    def extract_image_count(self, prompt: str) -> int:
+        match = re.search(r'--n ?(\d+)', prompt)
+        image_count = int(match.group(1)) if match else 1
+        image_count = max(1, min(image_count, self.max_images_per_request))
+        logger.debug("[Siliconflow2cow] 提取的图片数量: %s", image_count)
+        return image_count
+
     def clean_prompt_string(self, prompt: str, model_key: str) -> str:
-        clean_prompt = re.sub(r' --m ?\S+', '', re.sub(r'--ar \d+:\d+', '', prompt)).strip()
-        logger.debug(f"[Siliconflow2cow] 清理后的提示词: {clean_prompt}")
+        clean_prompt = re.sub(r' --m ?\S+', '', re.sub(r'--ar \d+:\d+', '', re.sub(r'--n ?\d+', '', prompt))).strip()
+        logger.debug("[Siliconflow2cow] 清理后的提示词: %s", clean_prompt)
         return clean_prompt
 
     def extract_image_url(self, text: str) -> str:
         match = re.search(r'(https?://[^\s]+?\.(?:png|jpe?g|gif|bmp|webp|svg|tiff|ico))(?:\s|$)', text, re.IGNORECASE)
         url = match.group(1) if match else None
-        logger.debug(f"[Siliconflow2cow] 提取的图片URL: {url}")
+        logger.debug("[Siliconflow2cow] 提取的图片URL: %s", url)
         return url
 
-    def convert_image_to_base64(self, image_url: str) -> str:
-        logger.debug(f"[Siliconflow2cow] 正在下载图片: {image_url}")
-        response = requests.get(image_url)
-        if response.status_code != 200:
-            logger.error(f"[Siliconflow2cow] 下载图片失败，状态码: {response.status_code}")
-            raise Exception('下载图片失败')
-        base64_image = f"data:image/webp;base64,{base64.b64encode(response.content).decode('utf-8')}"
+    def convert_image_to_base64(self, image_url: str, width: int = 1024, height: int = 1024, deadline: Deadline = None) -> str:
+        """下载参考图并缩小到目标尺寸，返回带真实 MIME 类型的 data URI"""
+        base64_image = self.source_images.to_data_uri(image_url, width, height, deadline)
         logger.debug("[Siliconflow2cow] 图片已成功转换为base64")
         return base64_image
 
     def remove_image_urls(self, text: str) -> str:
         cleaned_text = re.sub(r'https?://\S+\.(?:png|jpe?g|gif|bmp|webp|svg|tiff|ico)(?:\s|$)', '', text, flags=re.IGNORECASE)
-        logger.debug(f"[Siliconflow2cow] 移除图片URL后的文本: {cleaned_text}")
+        logger.debug("[Siliconflow2cow] 移除图片URL后的文本: %s", cleaned_text)
         return cleaned_text
 
+    def timeout_kwargs(self, call_type: str, deadline: Deadline, stage: str) -> dict:
+        """有时限时把该类调用的超时限制在剩余时间内；已超时则抛出 DeadlineExceeded"""
+        if deadline is None:
+            return {}
+        return {"timeout": deadline.timeout(self.transport.timeouts[call_type], stage)}
+
     def get_url_for_model(self, model_key: str) -> str:
-        URL_MAP = {
-            "dev": "https://api.siliconflow.cn/v1/image/generations",
-            "schnell": "https://api.siliconflow.cn/v1/black-forest-labs/FLUX.1-schnell/text-to-image",
-            "sd3": "https://api.siliconflow.cn/v1/stabilityai/stable-diffusion-3-medium/text-to-image",
-            "sdxl": "https://api.siliconflow.cn/v1/stabilityai/stable-diffusion-xl-base-1.0/text-to-image",
-            "sd2": "https://api.siliconflow.cn/v1/stabilityai/stable-diffusion-2-1/text-to-image",
-            "sdt": "https://api.siliconflow.cn/v1/stabilityai/sd-turbo/text-to-image",
-            "sdxlt": "https://api.siliconflow.cn/v1/stabilityai/sdxl-turbo/text-to-image",
-            "sdxll": "https://api.siliconflow.cn/v1/ByteDance/SDXL-Lightning/text-to-image",
-            "sd35": "https://api.siliconflow.cn/v1/images/generations"
-        }
-        url = URL_MAP.get(model_key, URL_MAP["schnell"])
-        logger.debug(f"[Siliconflow2cow] 选择的模型URL: {url}")
+        url = self.model_registry.text_request(model_key)[0]
+        logger.debug("[Siliconflow2cow] 选择的模型URL: %s", url)
         return url
 
     def get_img_url_for_model(self, model_key: str) -> str:
-        IMG_URL_MAP = {
-            "sdxl": "https://api.siliconflow.cn/v1/stabilityai/stable-diffusion-xl-base-1.0/image-to-image",
-            "sd2": "https://api.siliconflow.cn/v1/stabilityai/stable-diffusion-2-1/image-to-image",
-            "sdxll": "https://api.siliconflow.cn/v1/ByteDance/SDXL-Lightning/image-to-image",
-            "pm": "https://api.siliconflow.cn/v1/TencentARC/PhotoMaker/image-to-image"
-        }
-        url = IMG_URL_MAP.get(model_key, IMG_URL_MAP["sdxl"])
-        logger.debug(f"[Siliconflow2cow] 选择的图生图模型URL: {url}")
+        url = self.model_registry.img_request(model_key)[0]
+        logger.debug("[Siliconflow2cow] 选择的图生图模型URL: %s", url)
         return url
 
-    RATIO_MAP = {
-        "1:1": "1024x1024",
-        "1:2": "1024x2048",
-        "2:1": "2048x1024",
-        "3:2": "1536x1024",
-        "2:3": "1024x1536",
-        "4:3": "1536x1152",
-        "3:4": "1152x1536",
-        "16:9": "2048x1152",
-        "9:16": "1152x2048"       
-    }
-
-    def download_and_save_image(self, image_url: str) -> str:
-        logger.debug(f"[Siliconflow2cow] 正在下载并保存图片: {image_url}")
-        response = requests.get(image_url)
-        if response.status_code != 200:
-            logger.error(f"[Siliconflow2cow] 下载图片失败，状态码: {response.status_code}")
-            raise Exception('下载图片失败')
-
-        image = Image.open(BytesIO(response.content))
+    def download_and_save_image(self, image_url: str, request_key: str = None, model_key: str = "", deadline: Deadline = None) -> str:
+        logger.debug("[Siliconflow2cow] 正在下载并保存图片: %s", image_url)
+        with self.metrics.timer("download", model_key):
+            response = self.transport.get("download", image_url, deadline=deadline, stream=True)
+            try:
+                if response.status_code != 200:
+                    logger.error(f"[Siliconflow2cow] 下载图片失败，状态码: {response.status_code}")
+                    raise Exception('下载图片失败')
+                # 分块写入磁盘，保留接口返回的原始格式
+                chunks = response.iter_content(chunk_size=64 * 1024)
+                if deadline:
+                    chunks = deadline.guard(chunks, "图片下载")
+                file_path = self.image_store.put_stream(chunks)
+            finally:
+                response.close()
 
-        filename = f"{int(time.time())}.png"
-        file_path = os.path.join(self.image_output_dir, filename)
+        with self.metrics.timer("save", model_key):
+            ext = os.path.splitext(file_path)[1][1:]
+            if ext == "bin" or (self.image_convert_format and ext != self.image_convert_format.lower().replace("jpeg", "jpg")):
+                file_path = self.convert_saved_image(file_path)
 
-        image.save(file_path, format='PNG')
+            self.retention.add(file_path)
+            if request_key:
+                self.image_store.link(request_key, file_path)
 
         logger.info(f"[Siliconflow2cow] 图片已保存到 {file_path}")
         return file_path
 
+    def convert_saved_image(self, file_path: str) -> str:
+        """按配置转换图片格式（无法识别格式时转为 PNG），返回新文件路径"""
+        from PIL import Image
+
+        target = (self.image_convert_format or "PNG").upper()
+        with Image.open(file_path) as image:
+            if target == "JPEG" and image.mode not in ("RGB", "L"):
+                image = image.convert("RGB")
+            buffer = BytesIO()
+            image.save(buffer, format=target)
+        new_path = self.image_store.put(buffer.getvalue(), "jpg" if target == "JPEG" else target.lower())
+        if new_path != file_path:
+            os.remove(file_path)
+        return new_path
+
     def clean_all_images(self):
         """清理所有图片"""
         logger.debug("[Siliconflow2cow] 开始清理所有图片")
-        initial_count = len([name for name in os.listdir(self.image_output_dir) if os.path.isfile(os.path.join(self.image_output_dir, name))])
-
-        for filename in os.listdir(self.image_output_dir):
-            file_path = os.path.join(self.image_output_dir, filename)
-            if os.path.isfile(file_path):
-                os.remove(file_path)
-                logger.info(f"[Siliconflow2cow] 已删除图片: {file_path}")
-
-        final_count = len([name for name in os.listdir(self.image_output_dir) if os.path.isfile(os.path.join(self.image_output_dir, name))])
-
+        deleted_count, final_count = self.retention.clear_all()
         logger.debug("[Siliconflow2cow] 清理所有图片完成")
-        return Reply(ReplyType.TEXT, f"清理完成：已删除 {initial_count - final_count} 张图片，当前目录下还有 {final_count} 张图片。")
+        return Reply(ReplyType.TEXT, f"清理完成：已删除 {deleted_count} 张图片，当前目录下还有 {final_count} 张图片。")
 
     def clean_old_images(self):
-        """清理指定天数前的图片"""
-        logger.debug(f"[Siliconflow2cow] 开始检查是否需要清理旧图片，清理间隔：{self.clean_interval}天")
-        now = datetime.now()
-        cleaned_count = 0
-        for filename in os.listdir(self.image_output_dir):
-            file_path = os.path.join(self.image_output_dir, filename)
-            if os.path.isfile(file_path):
-                file_time = datetime.fromtimestamp(os.path.getmtime(file_path))
-                if now - file_time > timedelta(days=self.clean_interval):
-                    os.remove(file_path)
-                    cleaned_count += 1
-                    logger.info(f"[Siliconflow2cow] 已删除旧图片: {file_path}")
+        """清理过期的图片，超出总大小上限时再按最久未使用淘汰"""
+        logger.debug("[Siliconflow2cow] 开始检查是否需要清理旧图片，清理间隔：%s天", self.clean_interval)
+        cleaned_count = self.retention.run()
         if cleaned_count > 0:
-            logger.debug(f"[Siliconflow2cow] 清理旧图片完成，共清理 {cleaned_count} 张图片")
+            logger.debug("[Siliconflow2cow] 清理旧图片完成，共清理 %s 张图片", cleaned_count)
         else:
             logger.debug("[Siliconflow2cow] 没有需要清理的旧图片")
 
@@ -656,11 +1235,12 @@ class Siliconflow2cow(Plugin):
         help_text += "2. 在提示词后面添加 '--m' 来选择模型，例如：--m sdxl\n"
         help_text += "3. 使用 '--' 后跟比例来指定图片尺寸，例如：--ar 16:9\n"
         help_text += "4. 如果要进行图生图，直接在提示词中包含图片URL\n"
+        help_text += f"5. 使用 '--n' 后跟数量一次生成多张图片（最多{self.max_images_per_request}张，按张数计入使用次数），例如：--n 4\n"
         help_text += f"示例：{self.drawing_prefixes[0]} 一只可爱的小猫 --m dev --ar 16:9\n\n"
         help_text += "注意：您的提示词将会被AI自动优化以产生更好的结果。\n"
         help_text += "注意：各模型的参数已经过调整以提高图像质量。\n"
-        help_text += f"可用的模型：dev,schnell, sd35, sd3, sdxl, sd2, sdt, sdxlt, sdxll\n"
-        help_text += f"可用的尺寸比例：{', '.join(self.RATIO_MAP.keys())}\n"
+        help_text += f"可用的模型：{', '.join(spec.key for spec in self.model_registry.visible_models())}\n"
+        help_text += f"可用的尺寸比例：{', '.join(self.model_registry.ratios())}\n"
         help_text += f"图片将每{self.clean_interval}天自动清理一次。\n"
         help_text += f"输入 $sf_admin_password 密码 验证管理员，管理员不受每日次数限制，并可执行 '{self.drawing_prefixes[0]}clean_all' 来清理所有图片（警告：这将删除所有已生成的图片）\n"
         return help_text
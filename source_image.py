@@ -0,0 +1,119 @@
+import base64
+import threading
+from collections import OrderedDict
+from io import BytesIO
+from typing import Optional, Tuple
+
+from common.log import logger
+
+
+# 可以不经转码直接发送给接口的格式
+PASSTHROUGH_FORMATS = {"JPEG", "PNG", "WEBP"}
+
+
+class SourceImageTooLarge(Exception):
+    pass
+
+
+class _CacheEntry:
+    def __init__(self, payload: str, etag: Optional[str], last_modified: Optional[str]):
+        self.payload = payload
+        self.etag = etag
+        self.last_modified = last_modified
+
+
+class SourceImageProcessor:
+    """图生图参考图预处理：限制大小的流式下载、按目标尺寸缩小、使用真实 MIME 类型，并按 URL 缓存编码结果"""
+
+    def __init__(self, transport, max_bytes: int = 10 * 1024 * 1024, cache_entries: int = 32):
+        self.transport = transport
+        self.max_bytes = max_bytes
+        self.cache_entries = cache_entries
+        self._cache: "OrderedDict[Tuple[str, int, int], _CacheEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+
+    def to_data_uri(self, url: str, width: int, height: int, deadline=None) -> str:
+        key = (url, width, height)
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None:
+                self._cache.move_to_end(key)
+
+        headers = {}
+        if entry is not None:
+            if not entry.etag and not entry.last_modified:
+                # 没有校验信息的条目直接使用
+                with self._lock:
+                    self.hits += 1
+                return entry.payload
+            if entry.etag:
+                headers["If-None-Match"] = entry.etag
+            if entry.last_modified:
+                headers["If-Modified-Since"] = entry.last_modified
+
+        logger.debug("[Siliconflow2cow] 正在下载图片: %s", url)
+        response = self.transport.get("source", url, deadline=deadline, headers=headers, stream=True)
+        try:
+            if response.status_code == 304 and entry is not None:
+                with self._lock:
+                    self.revalidated += 1
+                logger.debug("[Siliconflow2cow] 参考图片未变化，使用缓存")
+                return entry.payload
+            if response.status_code != 200:
+                logger.error(f"[Siliconflow2cow] 下载图片失败，状态码: {response.status_code}")
+                raise Exception('下载图片失败')
+            data = self._read_capped(response)
+            etag = response.headers.get("ETag")
+            last_modified = response.headers.get("Last-Modified")
+        finally:
+            response.close()
+
+        payload = self._encode(data, width, height)
+        with self._lock:
+            self.misses += 1
+            self._cache[key] = _CacheEntry(payload, etag, last_modified)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_entries:
+                self._cache.popitem(last=False)
+        return payload
+
+    def _read_capped(self, response) -> bytes:
+        length = response.headers.get("Content-Length")
+        if length and length.isdigit() and int(length) > self.max_bytes:
+            raise SourceImageTooLarge(f"参考图片过大，最大支持 {self.max_bytes // 1024 // 1024}MB")
+        buffer = BytesIO()
+        for chunk in response.iter_content(chunk_size=64 * 1024):
+            buffer.write(chunk)
+            if buffer.tell() > self.max_bytes:
+                raise SourceImageTooLarge(f"参考图片过大，最大支持 {self.max_bytes // 1024 // 1024}MB")
+        return buffer.getvalue()
+
+    def _encode(self, data: bytes, width: int, height: int) -> str:
+        from PIL import Image
+
+        with Image.open(BytesIO(data)) as image:
+            fmt = image.format
+            if image.width <= width and image.height <= height and fmt in PASSTHROUGH_FORMATS:
+                # 尺寸已经合适，直接使用原始字节
+                body = data
+            else:
+                # JPEG 可在解码时直接缩小，其余格式解码后再缩放
+                image.draft(image.mode, (width, height))
+                image.thumbnail((width, height))
+                if fmt not in PASSTHROUGH_FORMATS:
+                    fmt = "PNG"
+                if fmt == "JPEG" and image.mode not in ("RGB", "L"):
+                    image = image.convert("RGB")
+                buffer = BytesIO()
+                image.save(buffer, format=fmt, quality=90)
+                body = buffer.getvalue()
+        mime = Image.MIME.get(fmt, "image/png")
+        logger.debug("[Siliconflow2cow] 参考图片已处理: %s, %.0fKB -> %.0fKB", fmt, len(data) / 1024, len(body) / 1024)
+        return f"data:{mime};base64,{base64.b64encode(body).decode('utf-8')}"
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "revalidated": self.revalidated, "misses": self.misses, "size": len(self._cache)}
@@ -0,0 +1,160 @@
+import random
+import threading
+import time
+from typing import Dict, Tuple
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import EmptyPoolError
+from urllib3.util import Timeout
+
+from common.log import logger
+
+
+# 各类调用的默认 (连接超时, 读取超时)，单位秒
+DEFAULT_TIMEOUTS = {
+    "chat": (5, 60),
+    "generate": (5, 180),
+    "download": (5, 60),
+    "source": (5, 30),
+}
+
+# GET 请求遇到这些状态码时视为可重试
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class PoolTimeout(requests.exceptions.ConnectTimeout):
+    """本地连接池已满，在连接超时内没有等到空闲连接（请求没有发往上游）"""
+
+
+class _BoundedWaitMixin:
+    """连接池已满时最多等待本次调用的连接超时（requests 不传 pool_timeout，urllib3 默认会一直等待）"""
+
+    def urlopen(self, method, url, *args, **kwargs):
+        if kwargs.get("pool_timeout") is None:
+            timeout = kwargs.get("timeout")
+            connect = timeout.connect_timeout if isinstance(timeout, Timeout) else timeout
+            if isinstance(connect, (int, float)):
+                kwargs["pool_timeout"] = connect
+        return super().urlopen(method, url, *args, **kwargs)
+
+
+class _BoundedHTTPConnectionPool(_BoundedWaitMixin, HTTPConnectionPool):
+    pass
+
+
+class _BoundedHTTPSConnectionPool(_BoundedWaitMixin, HTTPSConnectionPool):
+    pass
+
+
+class _BoundedWaitAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {"http": _BoundedHTTPConnectionPool, "https": _BoundedHTTPSConnectionPool}
+
+
+class HttpTransport:
+    """插件共享的 HTTP 传输层：长连接池、分类超时、GET 抖动退避重试、连接池统计"""
+
+    def __init__(self, pool_connections: int = 8, pool_maxsize: int = 16, pool_block: bool = True,
+                 timeouts: Dict[str, Tuple[float, float]] = None, get_retries: int = 3,
+                 backoff_base: float = 0.5, backoff_max: float = 8.0):
+        self.timeouts = dict(DEFAULT_TIMEOUTS)
+        for call_type, value in (timeouts or {}).items():
+            self.timeouts[call_type] = tuple(value)
+        self.get_retries = get_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        # pool_block=True 时每个主机的连接数不会超过 pool_maxsize；连接池已满时等待空闲连接的时间
+        # 不超过本次调用的连接超时（有时限的调用已限制在剩余时间内），超时后按连接超时处理
+        self.adapter = _BoundedWaitAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, pool_block=pool_block)
+        self.session = requests.Session()
+        self.session.mount("https://", self.adapter)
+        self.session.mount("http://", self.adapter)
+
+        self._lock = threading.Lock()
+        self._host_stats: Dict[str, Dict[str, int]] = {}
+        self._retries = 0
+
+    def post(self, call_type: str, url: str, **kwargs) -> requests.Response:
+        """发送 POST 请求（非幂等，不重试）"""
+        kwargs.setdefault("timeout", self.timeouts.get(call_type, DEFAULT_TIMEOUTS["generate"]))
+        return self._send("POST", url, **kwargs)
+
+    def get(self, call_type: str, url: str, deadline=None, **kwargs) -> requests.Response:
+        """发送 GET 请求，连接错误、超时或可重试状态码时按抖动指数退避重试
+
+        传入 deadline（Deadline）时每次尝试的超时不超过剩余时间，剩余时间不足以退避时不再重试。
+        """
+        timeout = kwargs.pop("timeout", self.timeouts.get(call_type, DEFAULT_TIMEOUTS["download"]))
+        attempt = 0
+        while True:
+            kwargs["timeout"] = deadline.timeout(timeout) if deadline else timeout
+            try:
+                response = self._send("GET", url, **kwargs)
+                if response.status_code not in RETRY_STATUS or attempt >= self.get_retries:
+                    return response
+                logger.warning(f"[Siliconflow2cow] GET {url} 返回 {response.status_code}，准备第 {attempt + 1} 次重试")
+                response.close()
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                if attempt >= self.get_retries or (deadline and deadline.expired()):
+                    raise
+                logger.warning(f"[Siliconflow2cow] GET {url} 失败: {e}，准备第 {attempt + 1} 次重试")
+            # full jitter：在 [0, min(上限, 基数 * 2^n)] 之间随机等待
+            backoff = random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+            if deadline:
+                backoff = min(backoff, deadline.remaining())
+            time.sleep(backoff)
+            attempt += 1
+            with self._lock:
+                self._retries += 1
+
+    def _send(self, method: str, url: str, **kwargs) -> requests.Response:
+        host = urlsplit(url).netloc
+        with self._lock:
+            stats = self._host_stats.setdefault(host, {"requests": 0, "in_flight": 0, "peak_in_flight": 0, "errors": 0})
+            stats["requests"] += 1
+            stats["in_flight"] += 1
+            stats["peak_in_flight"] = max(stats["peak_in_flight"], stats["in_flight"])
+        try:
+            return self.session.request(method, url, **kwargs)
+        except EmptyPoolError as e:
+            with self._lock:
+                stats["errors"] += 1
+            raise PoolTimeout(f"等待 {host} 的空闲连接超时") from e
+        except requests.exceptions.RequestException:
+            with self._lock:
+                stats["errors"] += 1
+            raise
+        finally:
+            with self._lock:
+                stats["in_flight"] -= 1
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """按主机汇总请求数、并发峰值以及 urllib3 连接池的建连/空闲情况"""
+        with self._lock:
+            result = {host: dict(values) for host, values in self._host_stats.items()}
+            result["_total"] = {"retries": self._retries}
+        pools = self.adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            host_stats = result.setdefault(pool.host if pool.port in (80, 443, None) else f"{pool.host}:{pool.port}", {})
+            host_stats["connections_opened"] = pool.num_connections
+            host_stats["pool_requests"] = pool.num_requests
+            # urllib3 的空闲队列预先填满 None 占位，只统计真正建立过的连接
+            host_stats["idle_connections"] = sum(1 for conn in list(pool.pool.queue) if conn is not None) if pool.pool is not None else 0
+        return result
+
+    def format_stats(self) -> str:
+        lines = []
+        for host, values in self.stats().items():
+            lines.append(f"{host}: " + ", ".join(f"{k}={v}" for k, v in values.items()))
+        return "\n".join(lines)
+
+    def close(self):
+        self.session.close()
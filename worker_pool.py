@@ -0,0 +1,68 @@
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Optional
+
+from common.log import logger
+
+
+class BoundedExecutor:
+    """固定线程数 + 有界等待队列的线程池，队列满时拒绝提交而不是无限堆积"""
+
+    def __init__(self, max_workers: int = 4, max_queue: int = 16, name: str = "sf2cow-worker"):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        # 同时允许存在的任务数 = 正在执行的 + 排队中的
+        self._slots = threading.BoundedSemaphore(max_workers + max_queue)
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._pending = 0
+        self._rejected = 0
+
+    def try_submit(self, fn: Callable, *args, **kwargs) -> Optional[Future]:
+        """提交任务，队列已满时返回 None"""
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._rejected += 1
+            logger.warning(f"[Siliconflow2cow] 任务队列已满（{self.max_workers} 执行中 + {self.max_queue} 排队），拒绝新任务")
+            return None
+        with self._lock:
+            self._pending += 1
+        try:
+            future = self._executor.submit(fn, *args, **kwargs)
+        except Exception:
+            self._release()
+            raise
+        future.add_done_callback(lambda _: self._release())
+        return future
+
+    def _release(self):
+        with self._lock:
+            self._pending -= 1
+            if self._pending == 0:
+                self._idle.notify_all()
+        self._slots.release()
+
+    def drain(self, timeout: float) -> bool:
+        """等待已提交的任务全部完成，超时返回 False"""
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            while self._pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._idle.wait(remaining)
+        return True
+
+    @property
+    def pending(self) -> int:
+        """执行中与排队中的任务总数"""
+        return self._pending
+
+    @property
+    def rejected(self) -> int:
+        return self._rejected
+
+    def shutdown(self, wait: bool = True, cancel_futures: bool = False):
+        self._executor.shutdown(wait=wait, cancel_futures=cancel_futures)